@@ -0,0 +1,207 @@
+"""Load test each gunicorn profile in ``gunicorn.conf.py`` against stubbed upstreams.
+
+CountAPI, and Shields.IO are replaced by local stub servers that wait a fixed
+latency before responding, standing in for the network calls each ``/badge``
+request makes. Each profile is started with gunicorn, and loaded by a fixed number
+of concurrent clients for a fixed duration. Live count streams are disabled, as
+they need the ``gevent`` profile.
+
+Run from the repository root::
+
+    python -m benchmarks.gunicorn_profiles --latency 0.05 --clients 64
+
+"""
+
+import argparse
+import os
+import statistics
+import subprocess  # noqa: S404
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# Root directory of the repository, where gunicorn is run from
+ROOT_DIRECTORY = Path(__file__).resolve().parents[1]
+
+
+def start_upstream_stub(latency: float) -> str:
+    """Start a stub of CountAPI, and Shields.IO that responds after ``latency``.
+
+    Args:
+        latency (float): Seconds to wait before responding.
+
+    Returns:
+        The base URL of the stub server.
+
+    """
+
+    def upstream(environ: Any, start_response: Callable[..., Any]) -> List[bytes]:
+        time.sleep(latency)
+        if environ["PATH_INFO"].startswith("/hit/"):
+            start_response("200 OK", [("Content-Type", "application/json")])
+            return [b'{"value": 1234}']
+        start_response("200 OK", [("Content-Type", "image/svg+xml")])
+        return [b"<svg xmlns='http://www.w3.org/2000/svg'/>"]
+
+    class QuietRequestHandler(WSGIRequestHandler):
+        def log_request(self, *args: Any, **kwargs: Any) -> None:
+            pass
+
+    server = make_server(
+        "127.0.0.1", 0, upstream, threaded=True, request_handler=QuietRequestHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def wait_for_server(url: str, timeout: float = 30.0) -> None:
+    """Wait until a server responds on its ``/cron`` page."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/cron", timeout=1).status_code == 200:
+                return
+        except requests.ConnectionError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Server at {url} did not start")
+
+
+def run_load(url: str, clients: int, duration: float) -> Dict[str, float]:
+    """Request ``/badge`` from concurrent clients for a fixed duration.
+
+    Args:
+        url (str): The base URL of the application.
+        clients (int): Number of concurrent clients.
+        duration (float): Seconds to run the load for.
+
+    Returns:
+        A dictionary of requests per second, median, and 99th percentile latency in
+        milliseconds, and the number of errors.
+
+    """
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index: int) -> None:
+        nonlocal errors
+        session = requests.Session()
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                response = session.get(
+                    f"{url}/badge", params={"page": f"page_{index}"}, timeout=30
+                )
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    percentiles = statistics.quantiles(latencies, n=100) if latencies else [0] * 99
+    return {
+        "requests_per_sec": round(len(latencies) / duration, 1),
+        "p50_ms": round(percentiles[49] * 1000, 1),
+        "p99_ms": round(percentiles[98] * 1000, 1),
+        "errors": errors,
+    }
+
+
+def benchmark_profile(
+    profile: str, upstream: str, port: int, clients: int, duration: float
+) -> Dict[str, float]:
+    """Start gunicorn with a profile, and load test it.
+
+    Args:
+        profile (str): The gunicorn profile name.
+        upstream (str): The base URL of the upstream stub.
+        port (int): The port to run gunicorn on.
+        clients (int): Number of concurrent clients.
+        duration (float): Seconds to run the load for.
+
+    Returns:
+        The load test results from ``run_load``.
+
+    """
+    env = {
+        **os.environ,
+        "DEFAULT_SHIELDS_IO_LABEL": "Visitors",
+        "DEFAULT_SHIELDS_IO_COLOR": "66FF00",
+        "GITHUB_REPOSITORY": "https://github.com/ESKYoung/shields-io-visitor-counter",
+        "HASH_KEY": "benchmark",
+        "HTML_CRON": "cron.html",
+        "URL_COUNTAPI": f"{upstream}/hit/benchmark",
+        "URL_SHIELDS_IO": upstream,
+        "GUNICORN_PROFILE": profile,
+        "STREAM_MAX_PAGES": "0",
+        "PORT": str(port),
+    }
+    process = subprocess.Popen(  # noqa: S603
+        [sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn.conf.py"],
+        cwd=ROOT_DIRECTORY,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}"
+        wait_for_server(url)
+        return run_load(url, clients, duration)
+    finally:
+        process.terminate()
+        _ = process.wait(timeout=30)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Run the profile load tests from the command line, printing a Markdown table.
+
+    Args:
+        argv (Optional[Sequence[str]]): Command line arguments. Default: None, which
+            uses ``sys.argv``.
+
+    Returns:
+        An exit code of zero.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--profiles", nargs="+", default=["sync", "gthread", "gevent"])
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--clients", type=int, default=64)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args(argv)
+
+    upstream = start_upstream_stub(args.latency)
+    print(f"CPUs: {os.cpu_count()}, upstream latency: {args.latency * 1000:.0f} ms")
+    print(f"clients: {args.clients}, duration: {args.duration:.0f} s\n")
+    print("| Profile | Requests/s | p50 (ms) | p99 (ms) | Errors |")
+    print("| :------ | ---------: | -------: | -------: | -----: |")
+    for profile in args.profiles:
+        result = benchmark_profile(
+            profile, upstream, args.port, args.clients, args.duration
+        )
+        print(
+            f"| `{profile}` | {result['requests_per_sec']} | {result['p50_ms']} | "
+            f"{result['p99_ms']} | {result['errors']} |"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
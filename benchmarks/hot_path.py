@@ -0,0 +1,274 @@
+"""Microbenchmarks for the ``/badge`` request hot path.
+
+Each benchmark reports operations per second, its speed relative to a fixed
+reference workload timed in alternating runs, and the peak traced memory allocated
+by a single call; speeds are the median over several runs. Results are compared to a
+stored baseline, and the run fails if any benchmark's relative speed is lower, or it
+allocates more, than the baseline allows. Relative speeds cancel out the machine,
+and its load at the time, so only code changes move them. I/O is stubbed, so only
+the Python layer is measured.
+
+Run from the repository root::
+
+    python -m benchmarks.hot_path             # compare to the baseline
+    python -m benchmarks.hot_path --update    # record a new baseline
+
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import statistics
+import sys
+import timeit
+import tracemalloc
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+from unittest.mock import patch
+
+# Set placeholder environmental variables, so ``main`` can be imported without them
+for _name, _value in {
+    "DEFAULT_SHIELDS_IO_LABEL": "Visitors",
+    "DEFAULT_SHIELDS_IO_COLOR": "66FF00",
+    "GITHUB_REPOSITORY": "https://github.com/ESKYoung/shields-io-visitor-counter",
+    "HASH_KEY": "benchmark",
+    "HTML_CRON": "cron.html",
+    "URL_COUNTAPI": "https://api.countapi.xyz/hit/shields-io-visitor-counter",
+    "URL_SHIELDS_IO": "https://img.shields.io/badge",
+}.items():
+    _ = os.environ.setdefault(_name, _value)
+
+import main  # noqa: E402
+from counters import MemoryBackend  # noqa: E402
+
+# Path to the stored baseline results
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+# Default tolerances for regressions in relative speed, and memory, as fractions of
+# the baseline. Memory allocated per call barely varies between runs, so is strict
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_MEMORY_TOLERANCE = 0.05
+
+# Default number of timed runs per benchmark
+DEFAULT_REPEAT = 11
+
+# A fixed Shields.IO response body returned by the stubbed ``requests.get``
+SVG = b"<svg xmlns='http://www.w3.org/2000/svg'/>"
+
+# Query strings for the benchmarked badge
+BADGE_QUERY = {
+    "page": "octocat.Spoon-Knife",
+    "label": "My First Counter",
+    "labelColor": "000000",
+    "logo": "GitHub",
+    "style": "for-the-badge",
+}
+
+
+def get_benchmarks() -> Dict[str, Callable[[], Any]]:
+    """Get the benchmarked callables, by name."""
+    client = main.app.test_client()
+    shields_io_kwargs = {k: v for k, v in BADGE_QUERY.items() if k != "page"}
+    return {
+        "get_page_hash": lambda: main.get_page_hash(BADGE_QUERY["page"]),
+        "compile_shields_io_url": lambda: main.compile_shields_io_url(
+            message="1234", color="1D70B8", **shields_io_kwargs
+        ),
+        "combine_url_and_query": lambda: main.combine_url_and_query(
+            "https://img.shields.io/badge/Visitors-1234-66FF00", "style=flat&logo=x"
+        ),
+        "get_shields_io_badge": lambda: client.get("/badge", query_string=BADGE_QUERY),
+    }
+
+
+def reference_workload() -> str:
+    """Hash, and format strings like the hot path, as a fixed yardstick for speeds."""
+    digest = hashlib.sha3_512(BADGE_QUERY["page"].encode("utf-8")).hexdigest()
+    return "&".join(f"{k}={v}" for k, v in sorted(BADGE_QUERY.items())) + digest
+
+
+def measure_speed(
+    func: Callable[[], Any], repeat: int = DEFAULT_REPEAT
+) -> Tuple[float, float]:
+    """Measure operations per second, and speed relative to the reference workload.
+
+    The callable, and ``reference_workload``, are timed in alternating runs, so both
+    see the same machine load, and the medians across runs are taken, so a few runs
+    slowed by other processes do not move the result.
+
+    Args:
+        func (Callable[[], Any]): The callable to time.
+        repeat (int): Number of timed runs. Default: 11.
+
+    Returns:
+        A tuple of the median operations per second, and the median ratio of
+        operations per second to those of the reference workload.
+
+    """
+    timer, reference = timeit.Timer(func), timeit.Timer(reference_workload)
+    number, _ = timer.autorange()
+    reference_number, _ = reference.autorange()
+    ops_per_sec, relative_speeds = [], []
+    for _ in range(repeat):
+        ops = number / timer.timeit(number)
+        reference_ops = reference_number / reference.timeit(reference_number)
+        ops_per_sec.append(ops)
+        relative_speeds.append(ops / reference_ops)
+    return statistics.median(ops_per_sec), statistics.median(relative_speeds)
+
+
+def measure_peak_bytes(func: Callable[[], Any]) -> int:
+    """Measure the peak memory traced by ``tracemalloc`` during a single call.
+
+    Args:
+        func (Callable[[], Any]): The callable to measure; called once beforehand to
+            warm any caches.
+
+    Returns:
+        The peak number of bytes allocated during the call.
+
+    """
+    _ = func()
+    tracemalloc.start()
+    try:
+        _ = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+
+def run_benchmarks(repeat: int = DEFAULT_REPEAT) -> Dict[str, Dict[str, float]]:
+    """Run all benchmarks with I/O stubbed.
+
+    Args:
+        repeat (int): Number of timed runs per benchmark. Default: 11.
+
+    Returns:
+        A dictionary of benchmark names to their ``ops_per_sec``,
+        ``relative_speed``, and ``peak_bytes_per_call`` results.
+
+    """
+    results = {}
+    with patch.object(main, "COUNTER", MemoryBackend()), patch(
+        "requests.get", lambda *args, **kwargs: SVG
+    ):
+        for name, func in get_benchmarks().items():
+            ops_per_sec, relative_speed = measure_speed(func, repeat)
+            results[name] = {
+                "ops_per_sec": round(ops_per_sec, 1),
+                "relative_speed": round(relative_speed, 4),
+                "peak_bytes_per_call": measure_peak_bytes(func),
+            }
+    return results
+
+
+def compare_results(
+    results: Dict[str, Dict[str, float]],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+    memory_tolerance: float = DEFAULT_MEMORY_TOLERANCE,
+) -> Dict[str, str]:
+    """Compare benchmark results to a baseline.
+
+    Speeds are compared by ``relative_speed``, as ``ops_per_sec`` depends on the
+    machine.
+
+    Args:
+        results (Dict[str, Dict[str, float]]): Results from ``run_benchmarks``.
+        baseline (Dict[str, Dict[str, float]]): Baseline results, in the same form.
+        tolerance (float): Allowed regression in relative speed, as a fraction of the
+            baseline.
+        memory_tolerance (float): Allowed regression in memory, as a fraction of the
+            baseline. Default: 0.05.
+
+    Returns:
+        A dictionary of regressed benchmark names to a description of the
+        regression; empty if there are none.
+
+    Examples:
+        >>> baseline = {"f": {"relative_speed": 2.0, "peak_bytes_per_call": 1000}}
+        >>> compare_results(
+        ...     {"f": {"relative_speed": 1.4, "peak_bytes_per_call": 1000}}, baseline, 0.25
+        ... )
+        {'f': 'relative_speed 1.4 is below 1.5 (baseline 2.0)'}
+        >>> compare_results(
+        ...     {"f": {"relative_speed": 2.0, "peak_bytes_per_call": 1100}}, baseline, 0.25
+        ... )
+        {'f': 'peak_bytes_per_call 1100 is above 1050.0 (baseline 1000)'}
+
+    """
+    regressions = {}
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        minimum_speed = expected["relative_speed"] * (1 - tolerance)
+        maximum_bytes = expected["peak_bytes_per_call"] * (1 + memory_tolerance)
+        if result["relative_speed"] < minimum_speed:
+            regressions[name] = (
+                f"relative_speed {result['relative_speed']} is below {minimum_speed} "
+                f"(baseline {expected['relative_speed']})"
+            )
+        elif result["peak_bytes_per_call"] > maximum_bytes:
+            regressions[name] = (
+                f"peak_bytes_per_call {result['peak_bytes_per_call']} is above "
+                f"{maximum_bytes} (baseline {expected['peak_bytes_per_call']})"
+            )
+    return regressions
+
+
+def main_cli(argv: Optional[Sequence[str]] = None) -> int:
+    """Run the benchmarks from the command line.
+
+    Args:
+        argv (Optional[Sequence[str]]): Command line arguments. Default: None, which
+            uses ``sys.argv``.
+
+    Returns:
+        An exit code of one if any benchmark regressed, otherwise zero.
+
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--update", action="store_true", help="Record a new baseline.")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float)
+    parser.add_argument("--memory-tolerance", type=float)
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.repeat)
+    print(json.dumps(results, indent=2))
+
+    stored = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    # Explicit tolerances, even zero, override the stored ones
+    tolerance = (
+        args.tolerance
+        if args.tolerance is not None
+        else stored.get("tolerance", DEFAULT_TOLERANCE)
+    )
+    memory_tolerance = (
+        args.memory_tolerance
+        if args.memory_tolerance is not None
+        else stored.get("memory_tolerance", DEFAULT_MEMORY_TOLERANCE)
+    )
+    if args.update:
+        stored = {
+            "tolerance": tolerance,
+            "memory_tolerance": memory_tolerance,
+            "benchmarks": results,
+        }
+        _ = args.baseline.write_text(json.dumps(stored, indent=2) + "\n")
+        return 0
+
+    regressions = compare_results(
+        results, stored.get("benchmarks", {}), tolerance, memory_tolerance
+    )
+    for name, description in regressions.items():
+        print(f"REGRESSION {name}: {description}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,416 @@
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, Mapping, Optional, Tuple
+
+import requests
+
+from visitlog import DEFAULT_LOCK_TIMEOUT, DEFAULT_SEGMENT_BYTES, VisitLog
+
+
+class CounterBackend(ABC):
+    """Abstract base class for a store of page counts, keyed by page hash."""
+
+    @abstractmethod
+    def hit(self, key: str) -> Optional[int]:
+        """Increment the count for a key by one.
+
+        Args:
+            key (str): A string as a unique key for the page.
+
+        Returns:
+            The incremented integer count, or None if the count is unavailable.
+
+        """
+
+    def get(self, key: str) -> Optional[int]:
+        """Get the count for a key without incrementing it.
+
+        Args:
+            key (str): A string as a unique key for the page.
+
+        Returns:
+            The integer count, or None if the count is unavailable.
+
+        Raises:
+            NotImplementedError: If the backend cannot read counts.
+
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support get")
+
+    def add(self, key: str, delta: int) -> Optional[int]:
+        """Add a delta to the count for a key.
+
+        Args:
+            key (str): A string as a unique key for the page.
+            delta (int): An integer to add to the current count; can be negative.
+
+        Returns:
+            The updated integer count, or None if the count is unavailable.
+
+        Raises:
+            NotImplementedError: If the backend cannot add arbitrary deltas.
+
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support add")
+
+    def set(self, key: str, value: int) -> None:
+        """Set the count for a key, overwriting any existing count.
+
+        Args:
+            key (str): A string as a unique key for the page.
+            value (int): An integer count.
+
+        Raises:
+            NotImplementedError: If the backend cannot overwrite counts.
+
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support set")
+
+    def set_many(self, counts: Mapping[str, int]) -> None:
+        """Set the counts for a batch of keys, overwriting any existing counts.
+
+        Backends override this if they can write a batch faster than key by key.
+
+        Args:
+            counts (Mapping[str, int]): A mapping of keys to integer counts.
+
+        """
+        for key, value in counts.items():
+            self.set(key, value)
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        """Iterate over all key-count pairs held by the backend.
+
+        Returns:
+            An iterator of key-count tuples.
+
+        Raises:
+            NotImplementedError: If the backend cannot enumerate its keys.
+
+        """
+        raise NotImplementedError(f"{type(self).__name__} does not support items")
+
+    def close(self) -> None:
+        """Release any resources held by the backend, such as open files."""
+
+
+class CountAPIBackend(CounterBackend):
+    """Counter backend using the CountAPI ``hit``, ``get``, and ``set`` endpoints.
+
+    Args:
+        url (str): A string for the CountAPI ``hit`` URL, including the namespace.
+        session (Optional[requests.Session]): A session to reuse connections for
+            ``get``, and ``set`` calls. Default: None.
+        max_workers (int): Number of concurrent requests made by ``set_many``.
+            Default: 1.
+        timeout (float): Seconds to wait for each ``get``, and ``set`` request.
+            Default: 10.0.
+
+    """
+
+    def __init__(
+        self,
+        url: str,
+        session: Optional[requests.Session] = None,
+        max_workers: int = 1,
+        timeout: float = 10.0,
+    ) -> None:
+        self.url = url.rstrip("/")
+        self.session = session
+        self.max_workers = max_workers
+        self.timeout = timeout
+
+    def _get_action_url(self, action: str, key: str) -> str:
+        """Get the CountAPI URL for another action on the same namespace and key.
+
+        Raises:
+            ValueError: If the URL is not a CountAPI ``hit`` URL.
+
+        """
+        base, separator, namespace = self.url.rpartition("/hit/")
+        if not separator:
+            raise ValueError(f"Not a CountAPI hit URL: {self.url}")
+        return f"{base}/{action}/{namespace}/{key}"
+
+    def hit(self, key: str) -> Optional[int]:
+        """Increment the count for a key by one using CountAPI.
+
+        Args:
+            key (str): A string as a unique key for the CountAPI URL.
+
+        Returns:
+            An integer count if CountAPI is called correctly, otherwise None.
+
+        """
+        # Get the count from CountAPI
+        countapi_response = requests.get(f"{self.url}/{key}")
+
+        # Check a correct return is supplied
+        if countapi_response and countapi_response.status_code == 200:
+            value: Optional[int] = countapi_response.json()["value"]
+            return value
+        else:
+            return None
+
+    def get(self, key: str) -> Optional[int]:
+        """Get the count for a key without incrementing it using CountAPI.
+
+        Args:
+            key (str): A string as a unique key for the CountAPI URL.
+
+        Returns:
+            An integer count if the key exists, otherwise None.
+
+        Raises:
+            requests.HTTPError: If CountAPI returns an error, other than HTTP 404.
+
+        """
+        response = (self.session or requests).get(
+            self._get_action_url("get", key), timeout=self.timeout
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        value: Optional[int] = response.json()["value"]
+        return value
+
+    def set(self, key: str, value: int) -> None:
+        """Set the count for a key using CountAPI.
+
+        Args:
+            key (str): A string as a unique key for the CountAPI URL.
+            value (int): An integer count.
+
+        Raises:
+            requests.HTTPError: If CountAPI returns an error.
+
+        """
+        response = (self.session or requests).get(
+            self._get_action_url("set", key),
+            params={"value": value},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+    def set_many(self, counts: Mapping[str, int]) -> None:
+        """Set the counts for a batch of keys, using concurrent CountAPI requests.
+
+        CountAPI has no batch endpoint, so keys are set by up to ``max_workers``
+        concurrent requests instead.
+
+        Args:
+            counts (Mapping[str, int]): A mapping of keys to integer counts.
+
+        """
+        if self.max_workers <= 1:
+            return super().set_many(counts)
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for _ in executor.map(self.set, counts.keys(), counts.values()):
+                pass
+
+
+class MemoryBackend(CounterBackend):
+    """Thread-safe counter backend holding counts in process memory.
+
+    Counts are lost when the process exits, and are not shared between worker
+    processes.
+
+    """
+
+    def __init__(self) -> None:
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def hit(self, key: str) -> Optional[int]:
+        """Increment the count for a key by one.
+
+        Args:
+            key (str): A string as a unique key for the page.
+
+        Returns:
+            The incremented integer count.
+
+        """
+        return self.add(key, 1)
+
+    def get(self, key: str) -> Optional[int]:
+        """Get the count for a key without incrementing it.
+
+        Args:
+            key (str): A string as a unique key for the page.
+
+        Returns:
+            The integer count; zero if the key has never been hit.
+
+        """
+        with self._lock:
+            return self._counts.get(key, 0)
+
+    def add(self, key: str, delta: int) -> Optional[int]:
+        """Add a delta to the count for a key, removing the key if it reaches zero.
+
+        Args:
+            key (str): A string as a unique key for the page.
+            delta (int): An integer to add to the current count; can be negative.
+
+        Returns:
+            The updated integer count.
+
+        """
+        with self._lock:
+            count = self._counts.get(key, 0) + delta
+            if count:
+                self._counts[key] = count
+            else:
+                _ = self._counts.pop(key, None)
+        return count
+
+    def set(self, key: str, value: int) -> None:
+        """Set the count for a key, removing the key if the count is zero.
+
+        Args:
+            key (str): A string as a unique key for the page.
+            value (int): An integer count.
+
+        """
+        with self._lock:
+            if value:
+                self._counts[key] = value
+            else:
+                _ = self._counts.pop(key, None)
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        """Iterate over a snapshot of all key-count pairs.
+
+        Returns:
+            An iterator of key-count tuples.
+
+        """
+        with self._lock:
+            snapshot = list(self._counts.items())
+        return iter(snapshot)
+
+
+class LogBackend(CounterBackend):
+    """Counter backend durably logging every change to an append-only visit log.
+
+    Counts are held in process memory, and survive restarts, and crashes; see
+    ``visitlog.VisitLog``. Keys must be page hashes of 64 hexadecimal characters.
+
+    Args:
+        directory (str): The log directory; only one process can open it at a time.
+        segment_bytes (int): Size a log segment can reach before a new one is
+            started, and the full ones compacted. Default: 4 MiB.
+        commit_delay (float): Seconds a group commit waits for more writers to join
+            it. Default: 0.0.
+        lock_timeout (float): Seconds to wait for another process to close the log
+            directory. Default: 30.0.
+
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        commit_delay: float = 0.0,
+        lock_timeout: float = DEFAULT_LOCK_TIMEOUT,
+    ) -> None:
+        self.log = VisitLog(directory, segment_bytes, commit_delay, lock_timeout)
+
+    def hit(self, key: str) -> Optional[int]:
+        """Increment the count for a key by one, once the change is durable.
+
+        Args:
+            key (str): A page hash key.
+
+        Returns:
+            The incremented integer count.
+
+        """
+        return self.log.add(key, 1)
+
+    def get(self, key: str) -> Optional[int]:
+        """Get the count for a key without incrementing it.
+
+        Args:
+            key (str): A page hash key.
+
+        Returns:
+            The integer count; zero if the key has never been hit.
+
+        """
+        return self.log.get(key)
+
+    def add(self, key: str, delta: int) -> Optional[int]:
+        """Add a delta to the count for a key, once the change is durable.
+
+        Args:
+            key (str): A page hash key.
+            delta (int): An integer to add to the current count; can be negative.
+
+        Returns:
+            The updated integer count.
+
+        """
+        return self.log.add(key, delta)
+
+    def set(self, key: str, value: int) -> None:
+        """Set the count for a key, once the change is durable.
+
+        Args:
+            key (str): A page hash key.
+            value (int): An integer count.
+
+        """
+        self.log.set_many({key: value})
+
+    def set_many(self, counts: Mapping[str, int]) -> None:
+        """Set the counts for a batch of keys in one group commit.
+
+        Args:
+            counts (Mapping[str, int]): A mapping of page hash keys to counts.
+
+        """
+        self.log.set_many(counts)
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        """Iterate over a snapshot of all key-count pairs, in key order.
+
+        Returns:
+            An iterator of key-count tuples.
+
+        """
+        return self.log.items()
+
+    def close(self) -> None:
+        """Sync any pending changes, and close the visit log."""
+        self.log.close()
+
+
+def get_counter_backend(
+    name: str, url_countapi: str, log_directory: str = "visits"
+) -> CounterBackend:
+    """Get a counter backend by name.
+
+    Args:
+        name (str): A string for the backend name; either "countapi", "memory", or
+            "log".
+        url_countapi (str): A string for the CountAPI ``hit`` URL.
+        log_directory (str): The visit log directory for the "log" backend.
+            Default: "visits".
+
+    Returns:
+        A ``CounterBackend`` instance.
+
+    Raises:
+        ValueError: If the backend name is not recognised.
+
+    """
+    if name == "countapi":
+        return CountAPIBackend(url_countapi)
+    elif name == "memory":
+        return MemoryBackend()
+    elif name == "log":
+        return LogBackend(log_directory)
+    raise ValueError(f"Unknown counter backend: {name}")
@@ -0,0 +1,119 @@
+"""Gunicorn configuration, with ``sync``, ``gthread``, and ``gevent`` profiles.
+
+Choose a profile with the ``GUNICORN_PROFILE`` environmental variable. Each
+``/badge`` request spends most of its time waiting on the counter backend, and
+Shields.IO, so the ``gthread``, and ``gevent`` profiles serve many requests per
+process while others wait.
+
+The default profile is ``gthread``. Live count streams are off by default; they
+hold a connection open indefinitely, and only see counts published in their own
+process, so once enabled by setting ``STREAM_MAX_PAGES`` above zero, the default,
+and only, profile is ``gevent``, with a single worker process.
+
+Worker, and thread counts are tuned from the CPU count, and can be overridden with
+the ``WEB_CONCURRENCY``, and ``GUNICORN_THREADS`` environmental variables. Counter
+backends holding counts in process memory, or a visit log, and cluster nodes,
+always run a single worker process, so every request sees the same counts, and
+cluster state.
+
+"""
+
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from typing import Any
+
+# Check if live count streams are enabled, and get the profile, and CPU count
+STREAMS = int(os.environ.get("STREAM_MAX_PAGES", "0")) > 0
+PROFILE = os.environ.get("GUNICORN_PROFILE", "gevent" if STREAMS else "gthread")
+CPU_COUNT = multiprocessing.cpu_count()
+
+# Check if the application holds per-process state that must not be split between
+# workers
+SINGLE_PROCESS = (
+    STREAMS
+    or os.environ.get("COUNTER_BACKEND", "countapi") != "countapi"
+    or bool(os.environ.get("CLUSTER_NODE"))
+)
+
+# Set the worker class, and default worker, and thread counts for the profile
+if PROFILE == "sync":
+    worker_class = "sync"
+    default_workers, default_threads = 2 * CPU_COUNT + 1, 1
+elif PROFILE == "gthread":
+    worker_class = "gthread"
+    default_workers, default_threads = CPU_COUNT + 1, 16
+elif PROFILE == "gevent":
+    worker_class = "gevent"
+    default_workers, default_threads = CPU_COUNT, 1
+    worker_connections = 1000
+else:
+    raise ValueError(f"Unknown gunicorn profile: {PROFILE}")
+
+# Streams each hold a thread in the other profiles, and a single worker would soon
+# run out
+if STREAMS and PROFILE != "gevent":
+    raise ValueError(
+        f"Live count streams need the gevent profile, not {PROFILE}; set "
+        "STREAM_MAX_PAGES=0 to disable them"
+    )
+
+# Run a single worker if needed, with the threads all the workers would have had
+if SINGLE_PROCESS:
+    default_threads *= default_workers if PROFILE == "gthread" else 1
+    default_workers = 1
+
+# Set the server options
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = (
+    default_workers
+    if SINGLE_PROCESS
+    else int(os.environ.get("WEB_CONCURRENCY", default_workers))
+)
+threads = int(os.environ.get("GUNICORN_THREADS", default_threads))
+keepalive = 5
+timeout = 30
+graceful_timeout = 30
+errorlog = "-"
+
+# Import the application in each worker, not in the arbiter, so per-process state,
+# background threads, and gevent's monkey patching all start in the worker
+preload_app = False
+
+# Seconds between checks for whether a worker has been told to shut down
+SHUTDOWN_POLL_INTERVAL = 0.1
+
+
+def post_fork(server: Any, worker: Any) -> None:
+    """Re-initialise per-process state if the application was imported pre-fork."""
+    if "main" in sys.modules:
+        sys.modules["main"].init_worker()
+
+
+def post_worker_init(worker: Any) -> None:
+    """Initialise per-process state once the worker has imported the application."""
+    sys.modules["main"].init_worker()
+    threading.Thread(
+        target=close_streams_on_shutdown, args=(worker,), daemon=True
+    ).start()
+
+
+def close_streams_on_shutdown(worker: Any) -> None:
+    """Close live count streams as soon as the worker is told to shut down.
+
+    Gunicorn has no hook for ``SIGTERM``, which only clears ``worker.alive``, so this
+    runs in a background thread. On a graceful reload, the old worker then exits once
+    its other requests finish, releasing any visit log the new worker waits for.
+
+    """
+    while worker.alive:
+        time.sleep(SHUTDOWN_POLL_INTERVAL)
+    sys.modules["main"].close_streams()
+
+
+def worker_exit(server: Any, worker: Any) -> None:
+    """Flush pending state before the worker exits."""
+    if "main" in sys.modules:
+        sys.modules["main"].shutdown_worker()
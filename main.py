@@ -1,12 +1,32 @@
 import hashlib
+import hmac
+import json
 import os
+import threading
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Any, Tuple, Union
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple, Union
 from urllib.parse import SplitResult, urlsplit, urlunsplit
 
 import requests
 import werkzeug
-from flask import Flask, Response, redirect, render_template, request
+from flask import Flask, Response, abort, jsonify, redirect, render_template, request
+
+from counters import CounterBackend, get_counter_backend
+from pubsub import Broker, Subscription
+from referrers import ReferrerTracker, normalise_referrer
+from replication import GCounterBackend, Gossiper, get_replica_store
+from sharding import (
+    CLUSTER_HOPS_HEADER,
+    CLUSTER_SECRET_HEADER,
+    MAX_FORWARD_HOPS,
+    HashRing,
+    create_session,
+    fetch_count,
+    forward_hit,
+    rebalance,
+    watch_counts,
+)
 
 # Import environmental variables
 DEFAULT_SHIELDS_IO_LABEL = os.environ["DEFAULT_SHIELDS_IO_LABEL"]
@@ -17,6 +37,112 @@ HTML_CRON = os.environ["HTML_CRON"]
 URL_COUNTAPI = os.environ["URL_COUNTAPI"].rstrip("/")
 URL_SHIELDS_IO = os.environ["URL_SHIELDS_IO"].rstrip("/")
 
+# Import optional environmental variables for the counter backend, and clustering
+COUNTER_BACKEND = os.environ.get("COUNTER_BACKEND", "countapi")
+LOG_DIRECTORY = os.environ.get("LOG_DIRECTORY", "visits")
+CLUSTER_NODE = os.environ.get("CLUSTER_NODE", "").rstrip("/")
+CLUSTER_NODES = [
+    n.strip().rstrip("/") for n in os.environ.get("CLUSTER_NODES", "").split(",")
+]
+CLUSTER_SECRET = os.environ.get("CLUSTER_SECRET", "")
+CLUSTER_MODE = os.environ.get("CLUSTER_MODE", "sharded")
+GOSSIP_INTERVAL = float(os.environ.get("GOSSIP_INTERVAL", "1"))
+STREAM_HEARTBEAT = float(os.environ.get("STREAM_HEARTBEAT", "15"))
+STREAM_MAX_PAGES = int(os.environ.get("STREAM_MAX_PAGES", "0"))
+
+# Import optional environmental variables for the referrer breakdown
+ADMIN_SECRET = os.environ.get("ADMIN_SECRET", "")
+REFERRER_SKETCH_WIDTH = int(os.environ.get("REFERRER_SKETCH_WIDTH", "256"))
+REFERRER_SKETCH_DEPTH = int(os.environ.get("REFERRER_SKETCH_DEPTH", "4"))
+REFERRER_TOP_K = int(os.environ.get("REFERRER_TOP_K", "10"))
+REFERRER_MAX_PAGES = int(os.environ.get("REFERRER_MAX_PAGES", "1000"))
+
+# Header used to authenticate admin requests
+ADMIN_SECRET_HEADER = "X-Admin-Secret"
+
+# Initialise the publish/subscribe hub for live count streams
+BROKER = Broker()
+
+# Initialise the per-page referrer sketches
+REFERRERS = ReferrerTracker(
+    REFERRER_SKETCH_WIDTH, REFERRER_SKETCH_DEPTH, REFERRER_TOP_K, REFERRER_MAX_PAGES
+)
+
+# Initialise the counter backend, and the hash ring if running as a sharded cluster.
+# The G-counter gossiper for a replicated cluster is started by `init_worker`
+CLUSTER_SESSION = create_session()
+CLUSTER_RING: Optional[HashRing] = None
+CLUSTER_LOCK = threading.Lock()
+GOSSIPER: Optional[Gossiper] = None
+COUNTER: CounterBackend
+if CLUSTER_NODE and CLUSTER_MODE == "replicated":
+    COUNTER = GCounterBackend(
+        CLUSTER_NODE,
+        (n for n in CLUSTER_NODES if n),
+        get_replica_store(COUNTER_BACKEND, LOG_DIRECTORY),
+    )
+elif CLUSTER_NODE:
+    COUNTER = get_counter_backend(COUNTER_BACKEND, URL_COUNTAPI, LOG_DIRECTORY)
+    CLUSTER_RING = HashRing(n for n in CLUSTER_NODES if n)
+else:
+    COUNTER = get_counter_backend(COUNTER_BACKEND, URL_COUNTAPI, LOG_DIRECTORY)
+
+# Process ID that `init_worker` last ran in
+WORKER_PID: Optional[int] = None
+
+
+def init_worker() -> None:
+    """Initialise per-process state, and start background tasks.
+
+    Runs on import, and again from the gunicorn ``post_fork``, and
+    ``post_worker_init`` hooks, but only does anything once per process. If the
+    application was imported before forking, connection pools are replaced, as
+    sockets cannot be shared between processes. G-counter replicas keep their slot
+    after forking, as cluster nodes only run one worker process.
+
+    """
+    global CLUSTER_SESSION, GOSSIPER, WORKER_PID
+
+    if WORKER_PID == os.getpid():
+        return
+    forked, WORKER_PID = WORKER_PID is not None, os.getpid()
+
+    if forked:
+        CLUSTER_SESSION = create_session()
+    if isinstance(COUNTER, GCounterBackend):
+        GOSSIPER = Gossiper(
+            COUNTER, CLUSTER_NODE, CLUSTER_SESSION, CLUSTER_SECRET, GOSSIP_INTERVAL
+        )
+        GOSSIPER.start()
+
+
+def shutdown_worker() -> None:
+    """Stop background tasks, and flush any pending state, before the process exits.
+
+    Called from the gunicorn ``worker_exit`` hook.
+
+    """
+    if WORKER_PID != os.getpid():
+        return
+    if GOSSIPER is not None:
+        GOSSIPER.stop()
+    COUNTER.close()
+
+
+def close_streams() -> None:
+    """Close all live count streams, and refuse new ones, so the process can exit.
+
+    Streams never finish by themselves, so would hold a gracefully stopping worker,
+    and any visit log it has open, until gunicorn's ``graceful_timeout``. Called
+    from ``gunicorn.conf.py`` as soon as the worker is told to shut down; clients
+    reconnect to the new worker.
+
+    """
+    BROKER.close()
+
+
+init_worker()
+
 # Initialise the flask app
 app = Flask(__name__)
 
@@ -67,29 +193,144 @@ def combine_url_and_query(url: Union[str, SplitResult], query: str) -> str:
 
 
 def get_page_count(key: str) -> Any:
-    """Get the page count using a CountAPI.
+    """Get the page count using the counter backend.
+
+    If running as a cluster, and another node owns the key on the hash ring, the hit
+    is forwarded to that node instead.
 
     Args:
-        key (str): A string as a unique key for the URL_COUNTER CountAPI URL.
+        key (str): A string as a unique key for the counter backend.
 
     Returns:
-        An integer count if CountAPI is called correctly, otherwise None.
+        An integer count if the counter backend is called correctly, otherwise None.
 
     """
     try:
-        # Get the count from CountAPI
-        countapi_response = requests.get(f"{URL_COUNTAPI}/{key}")
-
-        # Check a correct return is supplied
-        if countapi_response and countapi_response.status_code == 200:
-            return countapi_response.json()["value"]
+        # Forward the hit if another node owns the key, otherwise get the count from
+        # the local counter backend
+        owner = CLUSTER_RING.get_node(key) if CLUSTER_RING else None
+        if owner and owner != CLUSTER_NODE:
+            count = forward_hit(CLUSTER_SESSION, owner, key, CLUSTER_SECRET)
         else:
-            return None
+            count = COUNTER.hit(key)
+
+        # Publish the new count to any live count streams
+        if count is not None:
+            BROKER.publish(key, count)
+        return count
 
     except Exception:
         return None
 
 
+def read_page_count(key: str) -> Optional[int]:
+    """Read the page count without incrementing it.
+
+    If running as a cluster, and another node owns the key on the hash ring, the
+    count is read from that node instead.
+
+    Args:
+        key (str): A string as a unique key for the counter backend.
+
+    Returns:
+        An integer count if the key exists, otherwise None.
+
+    Raises:
+        NotImplementedError: If the local counter backend cannot read counts.
+
+    """
+    owner = CLUSTER_RING.get_node(key) if CLUSTER_RING else None
+    if owner and owner != CLUSTER_NODE:
+        return fetch_count(CLUSTER_SESSION, owner, key, CLUSTER_SECRET)
+    return COUNTER.get(key)
+
+
+def read_page_counts(keys: Iterable[str]) -> Dict[str, Optional[int]]:
+    """Read several page counts without incrementing them.
+
+    Args:
+        keys (Iterable[str]): Strings as unique keys for the counter backend.
+
+    Returns:
+        A dictionary of keys to their integer counts, or None if a count could not
+        be read.
+
+    """
+    counts: Dict[str, Optional[int]] = {}
+    for key in keys:
+        try:
+            counts[key] = read_page_count(key)
+        except Exception:
+            counts[key] = None
+    return counts
+
+
+def relay_page_counts(
+    subscription: Subscription,
+    node: str,
+    counts: Dict[str, Optional[int]],
+    stopped: threading.Event,
+) -> None:
+    """Relay count changes from the cluster node owning some keys to a subscription.
+
+    Runs in a background thread for each other node owning pages on a live count
+    stream, until ``stopped`` is set. Failed polls are retried every second.
+
+    Args:
+        subscription (Subscription): The live count stream's subscription.
+        node (str): The base URL of the node owning the keys.
+        counts (Dict[str, Optional[int]]): A dictionary of the keys to their last
+            known counts, or None if unknown; updated as changes are relayed.
+        stopped (threading.Event): Set once the live count stream closes.
+
+    """
+    while not stopped.is_set():
+        try:
+            changed = watch_counts(
+                CLUSTER_SESSION, node, counts, CLUSTER_SECRET, STREAM_HEARTBEAT
+            )
+        except Exception:
+            changed = None
+        if changed is None:
+            _ = stopped.wait(1)
+            continue
+        for key, count in changed.items():
+            if key in counts:
+                counts[key] = count
+                subscription.offer(key, count)
+
+
+def start_page_count_relays(
+    subscription: Subscription,
+    counts: Dict[str, Optional[int]],
+    stopped: threading.Event,
+) -> None:
+    """Start relaying count changes for keys owned by other cluster nodes.
+
+    Changes are only published on the node that counted them, so a background
+    thread running ``relay_page_counts`` is started for each other node owning any
+    of the keys.
+
+    Args:
+        subscription (Subscription): The live count stream's subscription.
+        counts (Dict[str, Optional[int]]): A dictionary of the subscribed keys to
+            their initial counts, or None if unknown.
+        stopped (threading.Event): Set once the live count stream closes.
+
+    """
+    owned: Dict[str, Dict[str, Optional[int]]] = defaultdict(dict)
+    for key, count in counts.items():
+        owner = CLUSTER_RING.get_node(key) if CLUSTER_RING else None
+        if owner and owner != CLUSTER_NODE:
+            owned[owner][key] = count
+    for node, node_counts in owned.items():
+        threading.Thread(
+            target=relay_page_counts,
+            args=(subscription, node, node_counts, stopped),
+            daemon=True,
+        ).start()
+
+
 def compile_shields_io_url(
     label: str,
     message: str,
@@ -154,6 +395,11 @@ def get_shields_io_badge() -> Union[Response, Tuple[str, int]]:
         message = "" if page_count is None else str(page_count)
         assert message
 
+        # Count the visit against the referring site, if there is one
+        referrer = normalise_referrer(request.headers.get("Referer"))
+        if referrer is not None:
+            _ = REFERRERS.add(page_hash[:64], referrer)
+
     except KeyError:
         # Modify the label and message to inform the user that the page argument is
         # missing
@@ -189,6 +435,326 @@ def get_shields_io_badge() -> Union[Response, Tuple[str, int]]:
     return Response(response=svg, content_type="image/svg+xml", headers=headers)
 
 
+def format_count_event(counts: Dict[str, int]) -> str:
+    """Format page counts as a Server-Sent Events ``count`` event.
+
+    Args:
+        counts (Dict[str, int]): A dictionary of page names to counts.
+
+    Returns:
+        A string for a single Server-Sent Events message.
+
+    Examples:
+        >>> format_count_event({"foo": 1})
+        'event: count\ndata: {"foo": 1}\n\n'
+
+    """
+    return f"event: count\ndata: {json.dumps(counts)}\n\n"
+
+
+@app.route("/stream")
+def stream_page_counts() -> Union[Response, Tuple[str, int]]:
+    """Stream live counts for one or more pages as Server-Sent Events.
+
+    Visiting this page does not increment any counts. Pages are given by repeating
+    the ``page`` argument. The current counts are sent first, if the counter backend
+    can read them without incrementing, from the node owning each page if running
+    as a cluster, followed by a ``count`` event whenever any
+    count changes; changes made between two events are coalesced into one. A
+    comment is sent every ``STREAM_HEARTBEAT`` seconds to keep idle connections open.
+
+    Changes are published within this application process, so streams need a single
+    worker process, as set by ``gunicorn.conf.py``. Replicated cluster nodes also
+    stream changes gossiped from their peers, and sharded cluster nodes relay changes
+    from the nodes owning each page. Streams are disabled, and this returns HTTP 404,
+    unless ``STREAM_MAX_PAGES`` is set above zero.
+
+    Returns:
+        A streaming ``text/event-stream`` response.
+
+    """
+    if STREAM_MAX_PAGES <= 0:
+        abort(404)
+    pages = list(dict.fromkeys(request.args.getlist("page")))
+    if not pages:
+        return "Missing required argument: page", 400
+    if len(pages) > STREAM_MAX_PAGES:
+        return f"Too many pages; the maximum is {STREAM_MAX_PAGES}", 400
+
+    # Map the page hashes back to page names, so subscribers never see the hashes
+    pages_by_key = {get_page_hash(p)[:64]: p for p in pages}
+
+    def generate_events() -> Iterator[str]:
+        subscription = BROKER.subscribe(pages_by_key)
+        stopped = threading.Event()
+        try:
+            initial = read_page_counts(pages_by_key)
+            yield format_count_event(
+                {pages_by_key[k]: c for k, c in initial.items() if c is not None}
+            )
+            start_page_count_relays(subscription, initial, stopped)
+
+            while not subscription.closed:
+                counts = subscription.wait(STREAM_HEARTBEAT)
+                if counts:
+                    yield format_count_event(
+                        {pages_by_key[k]: c for k, c in counts.items()}
+                    )
+                elif not subscription.closed:
+                    yield ": keep-alive\n\n"
+        finally:
+            stopped.set()
+            BROKER.unsubscribe(subscription)
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(
+        generate_events(), content_type="text/event-stream", headers=headers
+    )
+
+
+@app.route("/admin/referrers")
+def get_page_referrers() -> Union[Response, Tuple[Response, int]]:
+    """Get the estimated number of visits to a page from each referring site.
+
+    Counts are estimated by a Count-Min sketch, so may be slightly too high, but never
+    too low. Without any ``host`` arguments, the top referrers are returned.
+
+    Returns:
+        A JSON response with the ``page``, the ``total`` number of referred visits,
+        and a list of ``referrers`` with their ``host``, and estimated ``count``.
+
+    """
+    if not ADMIN_SECRET:
+        abort(404)
+    if not is_valid_secret(ADMIN_SECRET_HEADER, ADMIN_SECRET):
+        abort(403)
+
+    page = request.args.get("page")
+    if not page:
+        return jsonify(error="Missing required argument: page"), 400
+    hosts = [
+        normalise_referrer(h if "//" in h else f"//{h}") or h
+        for h in request.args.getlist("host")
+    ]
+    total, counts = REFERRERS.get(get_page_hash(page)[:64], hosts or None)
+    return jsonify(
+        page=page,
+        total=total,
+        referrers=[{"host": h, "count": c} for h, c in counts],
+    )
+
+
+def is_valid_secret(header: str, secret: str) -> bool:
+    """Check if a request header matches a secret, in constant time.
+
+    Header values are decoded as Latin-1, so they are encoded back to bytes before
+    comparing; ``hmac.compare_digest`` rejects non-ASCII strings.
+
+    Args:
+        header (str): The name of the request header holding the secret.
+        secret (str): The expected secret.
+
+    Returns:
+        True if the header matches the secret, otherwise False.
+
+    """
+    value = request.headers.get(header, "")
+    return hmac.compare_digest(value.encode("latin-1"), secret.encode("utf-8"))
+
+
+def check_cluster_request() -> None:
+    """Abort an internal cluster request if clustering is off, or it is unauthorised.
+
+    Raises:
+        werkzeug.exceptions.NotFound: If this application is not running as a cluster.
+        werkzeug.exceptions.Forbidden: If the request has an invalid cluster secret.
+
+    """
+    if not CLUSTER_NODE or not CLUSTER_SECRET:
+        abort(404)
+    if not is_valid_secret(CLUSTER_SECRET_HEADER, CLUSTER_SECRET):
+        abort(403)
+
+
+@app.route("/internal/count/<key>", methods=["GET", "POST"])
+def hit_owned_page_count(key: str) -> Union[Response, Tuple[Response, int]]:
+    """Get, or increment with ``POST``, the local count for a key.
+
+    Increments are forwarded from other cluster nodes that do not own the key. While
+    nodes are updated to a new ring, a node may be sent hits for a key it no longer
+    owns, so these are forwarded on to the owner on this node's ring, unless the hit
+    has already been forwarded ``MAX_FORWARD_HOPS`` times.
+
+    Returns:
+        A JSON response with the count as ``value``, or HTTP 404 if a ``GET`` finds
+        no count for the key.
+
+    """
+    check_cluster_request()
+    try:
+        owner = CLUSTER_RING.get_node(key) if CLUSTER_RING else None
+        hops = request.headers.get(CLUSTER_HOPS_HEADER, 1, type=int) or 1
+        if request.method != "POST":
+            value = COUNTER.get(key)
+            if value is None:
+                return jsonify(error="No count for key"), 404
+        elif owner and owner != CLUSTER_NODE and hops < MAX_FORWARD_HOPS:
+            value = forward_hit(
+                CLUSTER_SESSION, owner, key, CLUSTER_SECRET, hops=hops + 1
+            )
+        else:
+            value = COUNTER.hit(key)
+    except NotImplementedError:
+        return jsonify(error="Counter backend does not support reading counts"), 501
+    except Exception:
+        value = None
+    if value is None:
+        return jsonify(error="Error with counter backend"), 503
+    if request.method == "POST":
+        BROKER.publish(key, value)
+    return jsonify(value=value)
+
+
+@app.route("/internal/watch", methods=["POST"])
+def watch_page_counts() -> Union[Response, Tuple[Response, int]]:
+    """Wait for changes to counts on this node, for live count streams on other nodes.
+
+    The request is a JSON object with the last known ``counts`` for some keys, or
+    null if unknown, and the most seconds to ``wait``, up to ``STREAM_HEARTBEAT``.
+    Counts that already differ are returned immediately, otherwise this waits for
+    the next change.
+
+    Returns:
+        A JSON response with the changed ``counts``, empty if nothing changed.
+
+    """
+    check_cluster_request()
+    if STREAM_MAX_PAGES <= 0:
+        abort(404)
+    payload = request.get_json(silent=True) or {}
+    counts, wait = payload.get("counts"), payload.get("wait")
+    if (
+        not isinstance(counts, dict)
+        or not 0 < len(counts) <= STREAM_MAX_PAGES
+        or not all(c is None or isinstance(c, int) for c in counts.values())
+        or not isinstance(wait, (int, float))
+    ):
+        return jsonify(error="Expected a JSON object of counts, and a wait"), 400
+
+    subscription = BROKER.subscribe(counts)
+    try:
+        current = read_page_counts(counts)
+        changed = {k: c for k, c in current.items() if c is not None and c != counts[k]}
+        if not changed:
+            changed = subscription.wait(min(max(wait, 0), STREAM_HEARTBEAT))
+    finally:
+        BROKER.unsubscribe(subscription)
+    return jsonify(counts=changed)
+
+
+@app.route("/internal/counts", methods=["POST", "PUT"])
+def add_page_counts() -> Union[Response, Tuple[Response, int]]:
+    """Add, or overwrite with ``PUT``, a batch of counts sent as a JSON object.
+
+    Returns:
+        A JSON response with the number of keys updated.
+
+    """
+    check_cluster_request()
+    counts = request.get_json(silent=True)
+    if not isinstance(counts, dict) or not all(
+        isinstance(v, int) for v in counts.values()
+    ):
+        return jsonify(error="Expected a JSON object of integer counts"), 400
+    try:
+        if request.method == "PUT":
+            COUNTER.set_many(counts)
+        else:
+            for key, delta in counts.items():
+                _ = COUNTER.add(key, delta)
+    except NotImplementedError:
+        return jsonify(error="Counter backend does not support writing counts"), 501
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(updated=len(counts))
+
+
+@app.route("/internal/nodes", methods=["PUT"])
+def update_cluster_nodes() -> Union[Response, Tuple[Response, int]]:
+    """Update the cluster nodes, and hand off counts for keys this node lost.
+
+    Returns:
+        A JSON response with the nodes, the number of keys moved, and any nodes that
+        failed to accept their hand-off.
+
+    """
+    global CLUSTER_RING
+
+    check_cluster_request()
+    if CLUSTER_RING is None:
+        abort(404)
+    nodes = (request.get_json(silent=True) or {}).get("nodes")
+    if not isinstance(nodes, list) or not all(isinstance(n, str) for n in nodes):
+        return jsonify(error="Expected a JSON object with a list of nodes"), 400
+
+    # Swap in a new ring, so concurrent requests never see a partially built one,
+    # and serialise updates, so two hand-offs never run at once
+    with CLUSTER_LOCK:
+        CLUSTER_RING = ring = HashRing(n.rstrip("/") for n in nodes)
+        try:
+            moved, failed = rebalance(
+                ring, CLUSTER_NODE, COUNTER, CLUSTER_SESSION, CLUSTER_SECRET
+            )
+        except NotImplementedError:
+            # Shared backends, like CountAPI, hold no node-local counts to hand off
+            moved, failed = 0, []
+    return jsonify(nodes=ring.nodes, moved=moved, failed=failed)
+
+
+@app.route("/internal/gossip", methods=["GET", "POST"])
+def exchange_gossip() -> Union[Response, Tuple[Response, int]]:
+    """Get the full G-counter state, or merge a delta with ``POST``.
+
+    Returns:
+        A JSON response with the full state as ``counts``, or the number of keys
+        changed by the merge.
+
+    """
+    check_cluster_request()
+    if not isinstance(COUNTER, GCounterBackend):
+        abort(404)
+    if request.method == "GET":
+        return jsonify(counts=COUNTER.state())
+
+    payload = request.get_json(silent=True) or {}
+    counts, source = payload.get("counts"), payload.get("source")
+    if not isinstance(counts, dict) or not all(
+        isinstance(v, dict) and all(isinstance(c, int) for c in v.values())
+        for v in counts.values()
+    ):
+        return jsonify(error="Expected a JSON object of per-replica counts"), 400
+
+    # Publish merged counts, so live count streams follow visits to every node
+    changed = COUNTER.merge(counts, source)
+    for key, count in changed.items():
+        BROKER.publish(key, count)
+    return jsonify(changed=len(changed))
+
+
+@app.route("/internal/gossip/flush", methods=["POST"])
+def flush_gossip() -> Response:
+    """Run a gossip round immediately, sending all pending deltas to peers.
+
+    Returns:
+        A JSON response with the number of keys sent to each peer.
+
+    """
+    check_cluster_request()
+    if GOSSIPER is None:
+        abort(404)
+    return jsonify(sent=GOSSIPER.flush())
+
+
 @app.route("/cron")
 def cron_page() -> Any:
     """Add a page for cron jobs to wake up the application.
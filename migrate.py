@@ -0,0 +1,389 @@
+"""Stream page counts from one counter backend to another.
+
+Counts are read with bounded concurrency, written in batches, and the number of
+records written is checkpointed after every batch, so an interrupted migration
+resumes where it stopped; visit logs list their keys in sorted order, so this holds
+across compactions, as long as the source is not written to between runs. Memory use
+is constant, whatever the number of keys.
+
+CountAPI, and clusters cannot list their keys, so migrating from either needs a
+file of keys, one per line. Transient request failures are retried with exponential
+backoff. For example, to migrate from CountAPI into a sharded cluster::
+
+    export CLUSTER_SECRET=...
+    python migrate.py --source countapi --source-url "$URL_COUNTAPI" \\
+        --keys keys.txt --destination cluster \\
+        --destination-url http://127.0.0.1:5000,http://127.0.0.1:5001
+
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+import requests
+
+from counters import CountAPIBackend, CounterBackend, LogBackend
+from sharding import ClusterBackend, create_session
+
+T = TypeVar("T")
+
+# Default number of retries of a failed read, or batch write, and the delay before
+# the first retry in seconds, which doubles for every retry after
+DEFAULT_RETRIES = 5
+DEFAULT_BACKOFF = 0.5
+
+
+class MigrationResult(NamedTuple):
+    """Counts of records processed by a migration."""
+
+    position: int
+    written: int
+    skipped: int
+
+
+def read_keys(path: str) -> Iterator[str]:
+    """Lazily read non-empty keys from a file, one per line.
+
+    Args:
+        path (str): A path to the keys file, or "-" to read from stdin.
+
+    Yields:
+        Each key, stripped of whitespace.
+
+    """
+    with open(path) if path != "-" else sys.stdin as keys_file:
+        for line in keys_file:
+            key = line.strip()
+            if key:
+                yield key
+
+
+def is_retryable(error: requests.RequestException) -> bool:
+    """Check if a failed request may succeed if it is retried.
+
+    Args:
+        error (requests.RequestException): The error raised by the request.
+
+    Returns:
+        True for connection errors, timeouts, and HTTP 429, or 5xx responses,
+        otherwise False.
+
+    """
+    if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return True
+    status_code = getattr(error.response, "status_code", None)
+    return status_code is not None and (status_code == 429 or status_code >= 500)
+
+
+def call_with_retries(
+    func: Callable[..., T],
+    *args: Any,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+) -> T:
+    """Call a function, retrying transient request failures with exponential backoff.
+
+    Each delay is jittered, so concurrent calls that failed together do not all
+    retry at once.
+
+    Args:
+        func (Callable[..., T]): The function to call.
+        *args (Any): Positional arguments for ``func``.
+        retries (int): Maximum number of retries. Default: 5.
+        backoff (float): Seconds to wait before the first retry, doubling for every
+            retry after. Default: 0.5.
+
+    Returns:
+        The return value of ``func``.
+
+    Raises:
+        requests.RequestException: If the last attempt fails, or the failure is not
+            retryable.
+
+    """
+    attempt = 0
+    while True:
+        try:
+            return func(*args)
+        except requests.RequestException as error:
+            if attempt >= retries or not is_retryable(error):
+                raise
+            time.sleep(backoff * 2**attempt * random.uniform(0.5, 1.5))
+            attempt += 1
+
+
+def fetch_counts(
+    backend: CounterBackend,
+    keys: Iterable[str],
+    executor: ThreadPoolExecutor,
+    window: int,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+) -> Iterator[Tuple[str, Optional[int]]]:
+    """Get counts for keys concurrently, yielding them in the order of the keys.
+
+    At most ``window`` reads are in flight at once, so keys are consumed lazily, and
+    memory use does not grow with the number of keys. Transient failures are
+    retried, see ``call_with_retries``.
+
+    Args:
+        backend (CounterBackend): The backend to read counts from.
+        keys (Iterable[str]): Keys to read.
+        executor (ThreadPoolExecutor): The executor running ``backend.get`` calls.
+        window (int): The maximum number of reads in flight.
+        retries (int): Maximum number of retries per read. Default: 5.
+        backoff (float): Seconds to wait before the first retry. Default: 0.5.
+
+    Yields:
+        Tuples of each key, and its count, or None if the key does not exist.
+
+    """
+    in_flight: Deque[Tuple[str, "Future[Optional[int]]"]] = deque()
+    for key in keys:
+        future = executor.submit(
+            call_with_retries, backend.get, key, retries=retries, backoff=backoff
+        )
+        in_flight.append((key, future))
+        if len(in_flight) >= window:
+            key, future = in_flight.popleft()
+            yield key, future.result()
+    while in_flight:
+        key, future = in_flight.popleft()
+        yield key, future.result()
+
+
+def batched(iterable: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Split an iterable into lists of at most ``size`` items.
+
+    Examples:
+        >>> list(batched(range(5), 2))
+        [[0, 1], [2, 3], [4]]
+
+    """
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+def read_checkpoint(path: Optional[str]) -> int:
+    """Read the number of records already migrated from a checkpoint file.
+
+    Args:
+        path (Optional[str]): A path to the checkpoint file, or None.
+
+    Returns:
+        The checkpointed position, or zero if there is no checkpoint.
+
+    """
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path) as checkpoint_file:
+        position: int = json.load(checkpoint_file)["position"]
+    return position
+
+
+def write_checkpoint(path: str, position: int) -> None:
+    """Atomically write the number of records migrated to a checkpoint file.
+
+    Args:
+        path (str): A path to the checkpoint file.
+        position (int): The number of source records migrated so far.
+
+    """
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as checkpoint_file:
+        json.dump({"position": position}, checkpoint_file)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+    os.replace(temporary_path, path)
+
+
+def migrate(
+    records: Iterable[Tuple[str, Optional[int]]],
+    destination: CounterBackend,
+    batch_size: int = 500,
+    checkpoint: Optional[str] = None,
+    start: int = 0,
+    retries: int = DEFAULT_RETRIES,
+    backoff: float = DEFAULT_BACKOFF,
+) -> MigrationResult:
+    """Write key-count records to a destination backend in batches.
+
+    Records with no count, or a zero count, are skipped. Counts are overwritten, not
+    added, so re-running a batch after an interruption, or a transient failure, is
+    safe.
+
+    Args:
+        records (Iterable[Tuple[str, Optional[int]]]): Key-count records, already
+            advanced past the first ``start`` records.
+        destination (CounterBackend): The backend to write counts to.
+        batch_size (int): Maximum number of records per write. Default: 500.
+        checkpoint (Optional[str]): A path to write a checkpoint after every batch.
+            Default: None.
+        start (int): The position of the first record. Default: 0.
+        retries (int): Maximum number of retries per batch write. Default: 5.
+        backoff (float): Seconds to wait before the first retry. Default: 0.5.
+
+    Returns:
+        A ``MigrationResult`` with the final position, and the number of records
+        written, and skipped.
+
+    """
+    position, written, skipped = start, 0, 0
+    for batch in batched(records, batch_size):
+        counts = {key: count for key, count in batch if count}
+        if counts:
+            call_with_retries(
+                destination.set_many, counts, retries=retries, backoff=backoff
+            )
+        position += len(batch)
+        written += len(counts)
+        skipped += len(batch) - len(counts)
+        if checkpoint:
+            write_checkpoint(checkpoint, position)
+    return MigrationResult(position, written, skipped)
+
+
+def get_backend(name: str, url: str, concurrency: int) -> CounterBackend:
+    """Get a counter backend for migration by name.
+
+    Args:
+        name (str): A string for the backend name; either "countapi", "cluster", or
+            "log".
+        url (str): The CountAPI ``hit`` URL, comma-separated cluster node URLs, or
+            the visit log directory.
+        concurrency (int): Number of concurrent requests for batched writes.
+
+    Returns:
+        A ``CounterBackend`` instance.
+
+    Raises:
+        ValueError: If the backend name is not recognised.
+
+    """
+    session = create_session(pool_maxsize=concurrency)
+    if name == "countapi":
+        return CountAPIBackend(url, session=session, max_workers=concurrency)
+    elif name == "cluster":
+        nodes = [n.strip().rstrip("/") for n in url.split(",") if n.strip()]
+        return ClusterBackend(nodes, os.environ.get("CLUSTER_SECRET", ""), session)
+    elif name == "log":
+        return LogBackend(url)
+    raise ValueError(f"Unknown migration backend: {name}")
+
+
+# Names of the backends that can be migrated from, and to
+BACKENDS = ["countapi", "cluster", "log"]
+
+# Names of the backends that cannot list their keys, so need a keys file as a source
+UNLISTED_BACKENDS = ["countapi", "cluster"]
+
+
+def parse_args(argv: Optional[Sequence[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Stream page counts from one counter backend to another."
+    )
+    parser.add_argument("--source", required=True, choices=BACKENDS)
+    parser.add_argument("--source-url", required=True)
+    parser.add_argument(
+        "--keys",
+        help="File of keys to migrate, one per line, or '-' for stdin; required if "
+        "the source cannot list its keys.",
+    )
+    parser.add_argument("--destination", required=True, choices=BACKENDS)
+    parser.add_argument("--destination-url", required=True)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=DEFAULT_RETRIES,
+        help="Maximum retries of each failed read, or batch write.",
+    )
+    parser.add_argument(
+        "--backoff",
+        type=float,
+        default=DEFAULT_BACKOFF,
+        help="Seconds to wait before the first retry, doubling for every retry.",
+    )
+    parser.add_argument(
+        "--checkpoint", help="File to record progress to, and resume from."
+    )
+    args = parser.parse_args(argv)
+    if args.source in UNLISTED_BACKENDS and not args.keys:
+        parser.error(f"--keys is required for --source {args.source}")
+    return args
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Run a migration from the command line.
+
+    Args:
+        argv (Optional[Sequence[str]]): Command line arguments. Default: None, which
+            uses ``sys.argv``.
+
+    Returns:
+        An exit code of zero.
+
+    """
+    args = parse_args(argv)
+    source = get_backend(args.source, args.source_url, args.concurrency)
+    destination = get_backend(args.destination, args.destination_url, args.concurrency)
+    start = read_checkpoint(args.checkpoint)
+
+    with ThreadPoolExecutor(args.concurrency) as executor:
+        if args.keys:
+            keys = itertools.islice(read_keys(args.keys), start, None)
+            records: Iterator[Tuple[str, Optional[int]]] = fetch_counts(
+                source,
+                keys,
+                executor,
+                2 * args.concurrency,
+                args.retries,
+                args.backoff,
+            )
+        else:
+            records = itertools.islice(source.items(), start, None)
+        try:
+            result = migrate(
+                records,
+                destination,
+                args.batch_size,
+                args.checkpoint,
+                start,
+                args.retries,
+                args.backoff,
+            )
+        finally:
+            source.close()
+            destination.close()
+
+    summary: Dict[str, int] = result._asdict()
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, Set
+
+
+class Subscription:
+    """A subscriber to count changes for a fixed set of page hash keys.
+
+    Pending changes are held as the latest count per key, so the queue is bounded by
+    the number of subscribed keys, and any number of updates to a key between two
+    reads coalesce into one. Once closed, ``wait`` never blocks.
+
+    Args:
+        keys (Iterable[str]): Page hash keys to subscribe to.
+
+    """
+
+    def __init__(self, keys: Iterable[str]) -> None:
+        self.keys = frozenset(keys)
+        self.closed = False
+        self._pending: Dict[str, int] = {}
+        self._condition = threading.Condition()
+
+    def offer(self, key: str, count: int) -> None:
+        """Record a new count for a key, replacing any unread count; never blocks.
+
+        Args:
+            key (str): A page hash key.
+            count (int): The new count.
+
+        """
+        with self._condition:
+            self._pending[key] = count
+            self._condition.notify()
+
+    def wait(self, timeout: float) -> Dict[str, int]:
+        """Wait for count changes, and take all that are pending.
+
+        Args:
+            timeout (float): Maximum number of seconds to wait.
+
+        Returns:
+            A dictionary of changed keys to their latest counts; empty if there were
+            no changes before the timeout.
+
+        """
+        with self._condition:
+            if not self._pending and not self.closed:
+                _ = self._condition.wait(timeout)
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def close(self) -> None:
+        """Close the subscription, waking any waiting reader."""
+        with self._condition:
+            self.closed = True
+            self._condition.notify_all()
+
+
+class Broker:
+    """In-process publish/subscribe hub for count changes, keyed by page hash."""
+
+    def __init__(self) -> None:
+        self._subscriptions: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def subscribe(self, keys: Iterable[str]) -> Subscription:
+        """Subscribe to count changes for some keys.
+
+        Args:
+            keys (Iterable[str]): Page hash keys to subscribe to.
+
+        Returns:
+            A new ``Subscription``; pass it to ``unsubscribe`` when done. It is
+            already closed if the broker is.
+
+        """
+        subscription = Subscription(keys)
+        with self._lock:
+            if self._closed:
+                subscription.close()
+            for key in subscription.keys:
+                self._subscriptions[key].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Remove a subscription.
+
+        Args:
+            subscription (Subscription): A subscription returned by ``subscribe``.
+
+        """
+        with self._lock:
+            for key in subscription.keys:
+                subscriptions = self._subscriptions.get(key)
+                if subscriptions is not None:
+                    subscriptions.discard(subscription)
+                    if not subscriptions:
+                        del self._subscriptions[key]
+
+    def publish(self, key: str, count: int) -> None:
+        """Publish a new count for a key to all its subscribers.
+
+        Args:
+            key (str): A page hash key.
+            count (int): The new count.
+
+        """
+        # Skip taking the lock on the hot path if nobody is subscribed
+        if key not in self._subscriptions:
+            return
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(key, ()))
+        for subscription in subscriptions:
+            subscription.offer(key, count)
+
+    def close(self) -> None:
+        """Close all current, and future, subscriptions."""
+        with self._lock:
+            self._closed = True
+            subscriptions = set().union(*self._subscriptions.values())
+        for subscription in subscriptions:
+            subscription.close()
+
+    def __len__(self) -> int:
+        """Get the number of keys with at least one subscriber."""
+        with self._lock:
+            return len(self._subscriptions)
@@ -0,0 +1,227 @@
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+# Maximum length of a host name, so top-k entries have a fixed maximum size
+MAX_HOST_LENGTH = 253
+
+
+def normalise_referrer(referrer: Optional[str]) -> Optional[str]:
+    """Normalise a ``Referer`` header to its lower case host, without any ``www.``.
+
+    Args:
+        referrer (Optional[str]): The ``Referer`` header value, if any.
+
+    Returns:
+        The normalised host, or None if there is no valid host.
+
+    Examples:
+        >>> normalise_referrer("https://WWW.Example.com:8080/foo?bar=baz")
+        'example.com'
+        >>> normalise_referrer("not a url") is None
+        True
+
+    """
+    try:
+        host = urlsplit(referrer or "").hostname
+    except ValueError:
+        return None
+    if not host:
+        return None
+    host = host.rstrip(".")
+    if host.startswith("www."):
+        host = host[4:]
+    return host[:MAX_HOST_LENGTH] or None
+
+
+class CountMinSketch:
+    """Fixed-size Count-Min sketch of approximate counts per item.
+
+    Each item is counted in one cell of every row, chosen by a different hash per
+    row. Estimates are the minimum over rows, so are never too low, and are too high
+    by at most ``e / width`` of the total count with probability
+    ``1 - exp(-depth)``. Not thread-safe.
+
+    Args:
+        width (int): Number of cells per row.
+        depth (int): Number of rows.
+
+    """
+
+    def __init__(self, width: int, depth: int) -> None:
+        if width < 1 or depth < 1:
+            raise ValueError("Count-Min sketch width, and depth must be positive")
+        self.width = width
+        self.depth = depth
+        self.total = 0
+        self._cells = array("Q", bytes(8 * width * depth))
+
+    def _indices(self, item: str) -> Iterator[int]:
+        """Get the cell index of an item in each row, using double hashing."""
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        for row in range(self.depth):
+            yield row * self.width + (h1 + row * h2) % self.width
+
+    def add(self, item: str, count: int = 1) -> int:
+        """Add a count for an item.
+
+        Args:
+            item (str): The item to count.
+            count (int): A non-negative count to add. Default: 1.
+
+        Returns:
+            The new estimated count for the item.
+
+        """
+        estimate = None
+        for index in self._indices(item):
+            self._cells[index] += count
+            cell = self._cells[index]
+            estimate = cell if estimate is None else min(estimate, cell)
+        self.total += count
+        return estimate or 0
+
+    def estimate(self, item: str) -> int:
+        """Estimate the count for an item.
+
+        Args:
+            item (str): The item to estimate.
+
+        Returns:
+            The estimated count, which is never lower than the true count.
+
+        """
+        return min(self._cells[i] for i in self._indices(item))
+
+
+class ReferrerSketch:
+    """Approximate referrer counts for one page, in a fixed amount of memory.
+
+    Counts are kept in a Count-Min sketch, alongside the ``top_k`` referrers with
+    the highest estimated counts seen so far.
+
+    Args:
+        width (int): Number of cells per row of the Count-Min sketch.
+        depth (int): Number of rows of the Count-Min sketch.
+        top_k (int): Number of top referrers to keep.
+
+    """
+
+    def __init__(self, width: int, depth: int, top_k: int) -> None:
+        self.sketch = CountMinSketch(width, depth)
+        self.top_k = top_k
+        self._top: Dict[str, int] = {}
+
+    def add(self, host: str) -> int:
+        """Count a visit from a referrer host.
+
+        Args:
+            host (str): A normalised referrer host.
+
+        Returns:
+            The new estimated count for the host.
+
+        """
+        estimate = self.sketch.add(host)
+        if host in self._top or len(self._top) < self.top_k:
+            self._top[host] = estimate
+        elif self._top:
+            lowest = min(self._top, key=self._top.__getitem__)
+            if estimate > self._top[lowest]:
+                del self._top[lowest]
+                self._top[host] = estimate
+        return estimate
+
+    def top(self) -> List[Tuple[str, int]]:
+        """Get the top referrers, and their current estimated counts.
+
+        Returns:
+            A list of host-count tuples, in descending order of count.
+
+        """
+        counts = [(h, self.sketch.estimate(h)) for h in self._top]
+        return sorted(counts, key=lambda c: (-c[1], c[0]))
+
+
+class ReferrerTracker:
+    """Thread-safe per-page referrer sketches, keyed by page hash.
+
+    At most ``max_pages`` pages are tracked, so memory stays bounded however many
+    pages are visited; once full, the sketch of the page least recently visited with
+    a referrer is dropped to make room for a new page.
+
+    Args:
+        width (int): Number of cells per row of each Count-Min sketch.
+        depth (int): Number of rows of each Count-Min sketch.
+        top_k (int): Number of top referrers to keep per page.
+        max_pages (int): Maximum number of pages to track. Default: 1000.
+
+    """
+
+    def __init__(
+        self, width: int, depth: int, top_k: int, max_pages: int = 1000
+    ) -> None:
+        if max_pages < 1:
+            raise ValueError("Referrer tracker must track at least one page")
+        self.width = width
+        self.depth = depth
+        self.top_k = top_k
+        self.max_pages = max_pages
+        self._pages: "OrderedDict[str, ReferrerSketch]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Get the number of pages tracked."""
+        with self._lock:
+            return len(self._pages)
+
+    def add(self, key: str, host: str) -> int:
+        """Count a visit to a page from a referrer host.
+
+        Args:
+            key (str): A page hash key.
+            host (str): A normalised referrer host.
+
+        Returns:
+            The new estimated count for the host on the page.
+
+        """
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                if len(self._pages) >= self.max_pages:
+                    _ = self._pages.popitem(last=False)
+                page = self._pages[key] = ReferrerSketch(
+                    self.width, self.depth, self.top_k
+                )
+            else:
+                self._pages.move_to_end(key)
+            return page.add(host)
+
+    def get(
+        self, key: str, hosts: Optional[List[str]] = None
+    ) -> Tuple[int, List[Tuple[str, int]]]:
+        """Get the estimated referrer counts for a page.
+
+        Args:
+            key (str): A page hash key.
+            hosts (Optional[List[str]]): Normalised hosts to estimate. Default: None,
+                which returns the top referrers.
+
+        Returns:
+            A tuple of the total number of referred visits, and a list of host-count
+            tuples.
+
+        """
+        with self._lock:
+            page = self._pages.get(key)
+            if page is None:
+                return 0, [(h, 0) for h in hosts or []]
+            if hosts is None:
+                return page.sketch.total, page.top()
+            return page.sketch.total, [(h, page.sketch.estimate(h)) for h in hosts]
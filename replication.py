@@ -0,0 +1,359 @@
+import threading
+import uuid
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Mapping, Optional, Set, Tuple
+
+import requests
+
+from counters import CounterBackend, LogBackend
+from sharding import CLUSTER_SECRET_HEADER
+
+# Type alias for G-counter state; page hash keys mapped to per-replica counts
+GCounterState = Dict[str, Dict[str, int]]
+
+
+class GCounterBackend(CounterBackend):
+    """Counter backend holding a grow-only counter (G-counter) CRDT per page hash.
+
+    Each replica only ever increments its own slot of a counter, and merges other
+    replicas' slots by taking the maximum, so replicas accept hits locally, and
+    converge to the same sums in any order of delivery. Slots are named after the
+    node, so there is one per node however often it restarts; a restarted node
+    restores its slot by pulling the state of its peers before counting any hits.
+    If any peer can't be reached, that peer may hold a higher count for the slot,
+    so the node counts in a temporary slot instead; see ``new_incarnation``.
+
+    With a durable ``store``, the node's own slot is written to it before each hit
+    returns, and restored from it on start, so counts survive every node restarting
+    at once, and the node never needs a temporary slot. Other nodes' slots are still
+    only held in memory, and restored by gossip.
+
+    Changed keys are tracked per peer, so each gossip round only sends deltas.
+
+    Args:
+        node (str): The base URL of this node.
+        peers (Iterable[str]): Base URLs of the other nodes to gossip with.
+        store (Optional[CounterBackend]): A durable backend holding this node's own
+            slot. Default: None, which holds it in memory only.
+
+    """
+
+    def __init__(
+        self,
+        node: str,
+        peers: Iterable[str],
+        store: Optional[CounterBackend] = None,
+    ) -> None:
+        self.node = node
+        self.replica = node
+        self.peers = [p for p in peers if p != node]
+        self.store = store
+        self._state: GCounterState = defaultdict(dict)
+        self._dirty: Dict[str, Set[str]] = {p: set() for p in self.peers}
+        self._lock = threading.Lock()
+
+        # Restore this node's slot, and resend it, as peers may have lost it too
+        for key, count in store.items() if store is not None else ():
+            self._state[key][node] = count
+            self._mark_dirty(key)
+
+    @property
+    def durable(self) -> bool:
+        """Check if this node's own slot is held in a durable store."""
+        return self.store is not None
+
+    def new_incarnation(self) -> None:
+        """Switch to a new temporary slot, named after the node with a random suffix.
+
+        Used if this node's slot could not be restored from every peer, so hits are
+        never counted in a slot that a peer holds a higher count for. Counts already
+        in the old slot are kept, and still gossiped to peers. Temporary slots are
+        never removed, so only restarting nodes while peers are unreachable adds
+        slots.
+
+        """
+        with self._lock:
+            self.replica = f"{self.node}@{uuid.uuid4().hex[:8]}"
+
+    def _mark_dirty(self, key: str, source: Optional[str] = None) -> None:
+        """Mark a key as changed for every peer, except the one it came from."""
+        for peer, keys in self._dirty.items():
+            if peer != source:
+                keys.add(key)
+
+    def hit(self, key: str) -> Optional[int]:
+        """Increment this replica's slot of the counter for a key by one.
+
+        Args:
+            key (str): A string as a unique key for the page.
+
+        Returns:
+            The merged integer count across all known replicas.
+
+        """
+        return self.add(key, 1)
+
+    def add(self, key: str, delta: int) -> Optional[int]:
+        """Add a non-negative delta to this replica's slot of the counter for a key.
+
+        Args:
+            key (str): A string as a unique key for the page.
+            delta (int): A non-negative integer to add to the count.
+
+        Returns:
+            The merged integer count across all known replicas.
+
+        Raises:
+            ValueError: If ``delta`` is negative, as G-counters only grow.
+
+        """
+        if delta < 0:
+            raise ValueError("G-counters cannot be decremented")
+        if self.store is not None:
+            # Write the slot durably outside the lock, so concurrent hits can share
+            # the store's group commits
+            stored = self.store.add(key, delta) or 0
+            with self._lock:
+                slots = self._state[key]
+                slots[self.node] = max(slots.get(self.node, 0), stored)
+                self._mark_dirty(key)
+                return sum(slots.values())
+        with self._lock:
+            slots = self._state[key]
+            slots[self.replica] = slots.get(self.replica, 0) + delta
+            self._mark_dirty(key)
+            return sum(slots.values())
+
+    def get(self, key: str) -> Optional[int]:
+        """Get the merged count for a key without incrementing it.
+
+        Args:
+            key (str): A string as a unique key for the page.
+
+        Returns:
+            The merged integer count across all known replicas.
+
+        """
+        with self._lock:
+            return sum(self._state.get(key, {}).values())
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        """Iterate over a snapshot of all keys, and their merged counts.
+
+        Returns:
+            An iterator of key-count tuples.
+
+        """
+        with self._lock:
+            snapshot = [(k, sum(v.values())) for k, v in self._state.items()]
+        return iter(snapshot)
+
+    def state(self) -> GCounterState:
+        """Get a copy of the full G-counter state.
+
+        Returns:
+            A dictionary of page hash keys to per-replica counts.
+
+        """
+        with self._lock:
+            return {k: dict(v) for k, v in self._state.items()}
+
+    def close(self) -> None:
+        """Close the durable store, if any."""
+        if self.store is not None:
+            self.store.close()
+
+    def merge(
+        self, state: Mapping[str, Mapping[str, int]], source: Optional[str] = None
+    ) -> Dict[str, int]:
+        """Merge G-counter state from another replica, taking the maximum per slot.
+
+        Args:
+            state (Mapping[str, Mapping[str, int]]): Page hash keys mapped to
+                per-replica counts.
+            source (Optional[str]): The base URL of the sending node, which is not
+                sent the merged changes back. Default: None.
+
+        Returns:
+            A dictionary of the keys that changed to their new merged counts.
+
+        """
+        changed = {}
+        with self._lock:
+            for key, slots in state.items():
+                local = self._state[key]
+                updated = False
+                for replica, count in slots.items():
+                    if count > local.get(replica, 0):
+                        local[replica] = count
+                        updated = True
+                if updated:
+                    self._mark_dirty(key, source)
+                    changed[key] = sum(local.values())
+        return changed
+
+    def take_delta(self, peer: str, max_keys: int) -> GCounterState:
+        """Take up to ``max_keys`` changed keys not yet sent to a peer.
+
+        Args:
+            peer (str): The base URL of the peer.
+            max_keys (int): The maximum number of keys to take.
+
+        Returns:
+            A dictionary of the changed page hash keys to per-replica counts.
+
+        """
+        with self._lock:
+            dirty = self._dirty[peer]
+            keys = [dirty.pop() for _ in range(min(max_keys, len(dirty)))]
+            return {k: dict(self._state[k]) for k in keys}
+
+    def restore_delta(self, peer: str, delta: Mapping[str, object]) -> None:
+        """Mark the keys of an unsent delta as changed again for a peer.
+
+        Args:
+            peer (str): The base URL of the peer.
+            delta (Mapping[str, object]): A delta returned by ``take_delta``.
+
+        """
+        with self._lock:
+            self._dirty[peer].update(delta)
+
+
+def get_replica_store(name: str, log_directory: str) -> Optional[CounterBackend]:
+    """Get the store for a replica's own G-counter slot by counter backend name.
+
+    Args:
+        name (str): A string for the backend name; either "memory", or "log".
+        log_directory (str): The visit log directory for the "log" backend.
+
+    Returns:
+        A ``LogBackend`` for "log", or None for "memory", which holds the slot in
+        process memory only.
+
+    Raises:
+        ValueError: If the backend name is not "memory", or "log"; shared backends,
+            like CountAPI, cannot hold a slot for each node.
+
+    """
+    if name == "memory":
+        return None
+    elif name == "log":
+        return LogBackend(log_directory)
+    raise ValueError(
+        f"Replicated clusters need a memory, or log counter backend, not {name}"
+    )
+
+
+class Gossiper:
+    """Periodically send G-counter deltas to peers in batches.
+
+    Args:
+        backend (GCounterBackend): The local G-counter backend.
+        node (str): The base URL of this node, sent as the delta source.
+        session (requests.Session): A pooled session for internal requests.
+        secret (str): The shared cluster secret.
+        interval (float): Seconds between gossip rounds; if zero, or less, rounds
+            only run when ``flush`` is called.
+        batch_size (int): Maximum number of keys sent per request. Default: 500.
+
+    """
+
+    def __init__(
+        self,
+        backend: GCounterBackend,
+        node: str,
+        session: requests.Session,
+        secret: str,
+        interval: float,
+        batch_size: int = 500,
+    ) -> None:
+        self.backend = backend
+        self.node = node
+        self.session = session
+        self.secret = secret
+        self.interval = interval
+        self.batch_size = batch_size
+        self._flush_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Pull the full state from peers, and start periodic gossip rounds.
+
+        If any peer can't be reached, and the backend's own slot is not durable, the
+        backend switches to a temporary slot, as its own slot may not be fully
+        restored.
+
+        """
+        if self.pull() and not self.backend.durable:
+            self.backend.new_incarnation()
+        if self.interval > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Stop periodic gossip rounds, and send any remaining deltas."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        _ = self.flush()
+
+    def _run(self) -> None:
+        """Run gossip rounds until stopped."""
+        while not self._stopped.wait(self.interval):
+            _ = self.flush()
+
+    def pull(self) -> List[str]:
+        """Merge the full state of every reachable peer, such as after a restart.
+
+        Returns:
+            A list of peers that could not be reached.
+
+        """
+        failed = []
+        for peer in self.backend.peers:
+            try:
+                response = self.session.get(
+                    f"{peer}/internal/gossip",
+                    headers={CLUSTER_SECRET_HEADER: self.secret},
+                    timeout=10,
+                )
+                response.raise_for_status()
+                _ = self.backend.merge(response.json()["counts"])
+            except (requests.RequestException, ValueError, KeyError):
+                failed.append(peer)
+        return failed
+
+    def flush(self) -> Dict[str, int]:
+        """Run one gossip round, sending all pending deltas to every peer.
+
+        Deltas that fail to send are kept, and retried in the next round; merges are
+        idempotent, so resending is always safe.
+
+        Returns:
+            A dictionary of peers to the number of keys sent to them.
+
+        """
+        sent: Dict[str, int] = {}
+        with self._flush_lock:
+            for peer in self.backend.peers:
+                sent[peer] = 0
+                while True:
+                    delta = self.backend.take_delta(peer, self.batch_size)
+                    if not delta:
+                        break
+                    try:
+                        response = self.session.post(
+                            f"{peer}/internal/gossip",
+                            json={"source": self.node, "counts": delta},
+                            headers={CLUSTER_SECRET_HEADER: self.secret},
+                            timeout=10,
+                        )
+                        response.raise_for_status()
+                    except requests.RequestException:
+                        self.backend.restore_delta(peer, delta)
+                        break
+                    sent[peer] += len(delta)
+        return sent
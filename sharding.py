@@ -0,0 +1,417 @@
+import bisect
+import hashlib
+from collections import defaultdict
+from typing import Dict, Iterable, List, Mapping, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from counters import CounterBackend
+
+# Header used to authenticate requests between cluster nodes
+CLUSTER_SECRET_HEADER = "X-Cluster-Secret"
+
+# Header counting how many times a hit has been forwarded, and the most times it can
+# be, so nodes with different rings, while the nodes are updated, never loop a hit
+CLUSTER_HOPS_HEADER = "X-Cluster-Hops"
+MAX_FORWARD_HOPS = 2
+
+
+class HashRing:
+    """Consistent-hash ring mapping page hash keys to cluster nodes.
+
+    Each node is placed on the ring at ``replicas`` virtual node positions, so keys
+    are spread evenly, and only around ``1/N`` of keys move when a node joins or
+    leaves a ring of ``N`` nodes.
+
+    Args:
+        nodes (Iterable[str]): Base URLs of the nodes in the ring.
+        replicas (int): Number of virtual nodes per node. Default: 128.
+
+    Examples:
+        >>> ring = HashRing(["http://a", "http://b"])
+        >>> ring.get_node("f" * 64) in {"http://a", "http://b"}
+        True
+
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), replicas: int = 128) -> None:
+        self.replicas = replicas
+        self._nodes: List[str] = []
+        self._positions: List[int] = []
+        self._owners: List[str] = []
+        for node in nodes:
+            self.add_node(node)
+
+    @property
+    def nodes(self) -> List[str]:
+        """List the nodes in the ring, in the order they were added."""
+        return list(self._nodes)
+
+    @staticmethod
+    def _get_node_position(node: str, replica: int) -> int:
+        """Get the ring position of a virtual node."""
+        obj_hash = hashlib.sha3_512(f"{node}#{replica}".encode("utf-8"))
+        return int(obj_hash.hexdigest()[:16], 16)
+
+    @staticmethod
+    def _get_key_position(key: str) -> int:
+        """Get the ring position of a key.
+
+        Keys produced by ``get_page_hash`` are already uniformly distributed hex
+        strings, so their leading 64 bits are used directly; any other key is hashed
+        first.
+
+        """
+        try:
+            return int(key[:16], 16)
+        except ValueError:
+            return int(hashlib.sha3_512(key.encode("utf-8")).hexdigest()[:16], 16)
+
+    def add_node(self, node: str) -> None:
+        """Add a node, and its virtual nodes, to the ring.
+
+        Args:
+            node (str): The base URL of the node.
+
+        """
+        if node in self._nodes:
+            return
+        self._nodes.append(node)
+        for replica in range(self.replicas):
+            position = self._get_node_position(node, replica)
+            index = bisect.bisect(self._positions, position)
+            self._positions.insert(index, position)
+            self._owners.insert(index, node)
+
+    def remove_node(self, node: str) -> None:
+        """Remove a node, and its virtual nodes, from the ring.
+
+        Args:
+            node (str): The base URL of the node.
+
+        """
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        kept = [(p, o) for p, o in zip(self._positions, self._owners) if o != node]
+        self._positions = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def get_node(self, key: str) -> Optional[str]:
+        """Get the node that owns a key.
+
+        Args:
+            key (str): A page hash key.
+
+        Returns:
+            The base URL of the owning node, or None if the ring is empty.
+
+        """
+        if not self._positions:
+            return None
+        index = bisect.bisect(self._positions, self._get_key_position(key))
+        return self._owners[index % len(self._owners)]
+
+
+def create_session(pool_maxsize: int = 32) -> requests.Session:
+    """Create a ``requests.Session`` with pooled keep-alive connections.
+
+    Args:
+        pool_maxsize (int): Maximum number of connections kept per node. Default: 32.
+
+    Returns:
+        A ``requests.Session`` object for internal requests between nodes.
+
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=16, pool_maxsize=pool_maxsize)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def forward_hit(
+    session: requests.Session,
+    node: str,
+    key: str,
+    secret: str,
+    timeout: float = 2.0,
+    hops: int = 1,
+) -> Optional[int]:
+    """Forward a page hit to the node owning the key.
+
+    Args:
+        session (requests.Session): A pooled session for internal requests.
+        node (str): The base URL of the owning node.
+        key (str): A page hash key.
+        secret (str): The shared cluster secret.
+        timeout (float): Request timeout in seconds. Default: 2.0.
+        hops (int): The number of times the hit has been forwarded, including this
+            time. Default: 1.
+
+    Returns:
+        The integer count returned by the owning node, or None if it failed.
+
+    """
+    response = session.post(
+        f"{node}/internal/count/{key}",
+        headers={CLUSTER_SECRET_HEADER: secret, CLUSTER_HOPS_HEADER: str(hops)},
+        timeout=timeout,
+    )
+    if response.status_code == 200:
+        value: Optional[int] = response.json()["value"]
+        return value
+    return None
+
+
+def fetch_count(
+    session: requests.Session,
+    node: str,
+    key: str,
+    secret: str,
+    timeout: float = 2.0,
+) -> Optional[int]:
+    """Get the count for a key from the node owning it, without incrementing it.
+
+    Args:
+        session (requests.Session): A pooled session for internal requests.
+        node (str): The base URL of the owning node.
+        key (str): A page hash key.
+        secret (str): The shared cluster secret.
+        timeout (float): Request timeout in seconds. Default: 2.0.
+
+    Returns:
+        The integer count returned by the owning node, or None if it failed.
+
+    """
+    response = session.get(
+        f"{node}/internal/count/{key}",
+        headers={CLUSTER_SECRET_HEADER: secret},
+        timeout=timeout,
+    )
+    if response.status_code == 200:
+        value: Optional[int] = response.json()["value"]
+        return value
+    return None
+
+
+def watch_counts(
+    session: requests.Session,
+    node: str,
+    counts: Mapping[str, Optional[int]],
+    secret: str,
+    wait: float,
+) -> Optional[Dict[str, int]]:
+    """Wait for count changes to keys owned by another node, by long polling it.
+
+    The owning node replies as soon as any of its counts differ from those given, so
+    changes made between two polls are never missed.
+
+    Args:
+        session (requests.Session): A pooled session for internal requests.
+        node (str): The base URL of the owning node.
+        counts (Mapping[str, Optional[int]]): A mapping of page hash keys to their
+            last known counts, or None if unknown.
+        secret (str): The shared cluster secret.
+        wait (float): Maximum number of seconds for the owning node to wait for a
+            change; the request times out a few seconds later.
+
+    Returns:
+        A dictionary of changed keys to their new counts, empty if nothing changed
+        before the wait ended, or None if the request failed.
+
+    """
+    response = session.post(
+        f"{node}/internal/watch",
+        json={"counts": dict(counts), "wait": wait},
+        headers={CLUSTER_SECRET_HEADER: secret},
+        timeout=wait + 5.0,
+    )
+    if response.status_code == 200:
+        changed: Dict[str, int] = response.json()["counts"]
+        return changed
+    return None
+
+
+def send_counts(
+    session: requests.Session,
+    node: str,
+    counts: Mapping[str, int],
+    secret: str,
+    timeout: float = 10.0,
+    overwrite: bool = False,
+) -> bool:
+    """Send a batch of count increments, or overwriting counts, to a node.
+
+    Args:
+        session (requests.Session): A pooled session for internal requests.
+        node (str): The base URL of the receiving node.
+        counts (Mapping[str, int]): A mapping of page hash keys to count increments.
+        secret (str): The shared cluster secret.
+        timeout (float): Request timeout in seconds. Default: 10.0.
+        overwrite (bool): If True, overwrite the node's counts instead of adding to
+            them. Default: False.
+
+    Returns:
+        True if the node accepted the batch, otherwise False.
+
+    """
+    response = session.request(
+        "PUT" if overwrite else "POST",
+        f"{node}/internal/counts",
+        json=dict(counts),
+        headers={CLUSTER_SECRET_HEADER: secret},
+        timeout=timeout,
+    )
+    return response.status_code == 200
+
+
+def rebalance(
+    ring: HashRing,
+    node: str,
+    backend: CounterBackend,
+    session: requests.Session,
+    secret: str,
+    batch_size: int = 500,
+) -> Tuple[int, List[str]]:
+    """Hand off local counts for keys no longer owned by this node.
+
+    Counts are sent to their new owners in batches, and only subtracted from the
+    local backend once the owner accepts them, so a failed hand-off can be retried.
+
+    Args:
+        ring (HashRing): The updated hash ring.
+        node (str): The base URL of this node.
+        backend (CounterBackend): The local counter backend.
+        session (requests.Session): A pooled session for internal requests.
+        secret (str): The shared cluster secret.
+        batch_size (int): Maximum number of keys sent per request. Default: 500.
+
+    Returns:
+        A tuple of the number of keys moved, and a list of nodes that failed to
+        accept their batch.
+
+    """
+    batches: Dict[str, Dict[str, int]] = defaultdict(dict)
+    moved, failed = 0, []
+
+    def flush(owner: str) -> None:
+        nonlocal moved
+        batch = batches.pop(owner)
+        try:
+            accepted = send_counts(session, owner, batch, secret)
+        except requests.RequestException:
+            accepted = False
+        if not accepted:
+            failed.append(owner)
+            return
+        for key, count in batch.items():
+            _ = backend.add(key, -count)
+        moved += len(batch)
+
+    for key, count in backend.items():
+        owner = ring.get_node(key)
+        if owner is None or owner == node or owner in failed:
+            continue
+        batches[owner][key] = count
+        if len(batches[owner]) >= batch_size:
+            flush(owner)
+
+    for owner in list(batches):
+        flush(owner)
+
+    return moved, failed
+
+
+class ClusterBackend(CounterBackend):
+    """Counter backend for a remote sharded cluster, routing keys to their owners.
+
+    Args:
+        nodes (Iterable[str]): Base URLs of the nodes in the cluster.
+        secret (str): The shared cluster secret.
+        session (Optional[requests.Session]): A pooled session for internal
+            requests. Default: None, which creates a new session.
+
+    """
+
+    def __init__(
+        self,
+        nodes: Iterable[str],
+        secret: str,
+        session: Optional[requests.Session] = None,
+    ) -> None:
+        self.ring = HashRing(nodes)
+        self.secret = secret
+        self.session = session or create_session()
+
+    def _get_owner(self, key: str) -> str:
+        """Get the node owning a key, raising a ``ValueError`` if there are none."""
+        owner = self.ring.get_node(key)
+        if owner is None:
+            raise ValueError("Cluster has no nodes")
+        return owner
+
+    def hit(self, key: str) -> Optional[int]:
+        """Increment the count for a key by one on its owning node.
+
+        Args:
+            key (str): A page hash key.
+
+        Returns:
+            The incremented integer count, or None if the owning node failed.
+
+        """
+        return forward_hit(self.session, self._get_owner(key), key, self.secret)
+
+    def get(self, key: str) -> Optional[int]:
+        """Get the count for a key from its owning node.
+
+        Args:
+            key (str): A page hash key.
+
+        Returns:
+            The integer count, or None if the owning node has no count for the key.
+
+        Raises:
+            requests.HTTPError: If the owning node returns an error, other than HTTP
+                404.
+
+        """
+        response = self.session.get(
+            f"{self._get_owner(key)}/internal/count/{key}",
+            headers={CLUSTER_SECRET_HEADER: self.secret},
+            timeout=10,
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        value: Optional[int] = response.json()["value"]
+        return value
+
+    def set_many(self, counts: Mapping[str, int]) -> None:
+        """Set the counts for a batch of keys, with one request per owning node.
+
+        Args:
+            counts (Mapping[str, int]): A mapping of page hash keys to counts.
+
+        Raises:
+            requests.HTTPError: If any owning node rejects its batch.
+
+        """
+        batches: Dict[str, Dict[str, int]] = defaultdict(dict)
+        for key, value in counts.items():
+            batches[self._get_owner(key)][key] = value
+        for owner, batch in batches.items():
+            if not send_counts(self.session, owner, batch, self.secret, overwrite=True):
+                raise requests.HTTPError(f"Node {owner} rejected a batch of counts")
+
+    def set(self, key: str, value: int) -> None:
+        """Set the count for a key on its owning node.
+
+        Args:
+            key (str): A page hash key.
+            value (int): An integer count.
+
+        """
+        self.set_many({key: value})
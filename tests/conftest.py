@@ -1,7 +1,22 @@
+import json
 import os
+import socket
+import subprocess  # noqa: S404
+import sys
+import time
+from pathlib import Path
+from threading import Thread
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Tuple
 
 import pytest
+import requests
 from pytest_mock import MockerFixture
+from werkzeug.serving import make_server
+from werkzeug.wrappers import Request
+from werkzeug.wrappers import Response as WerkzeugResponse
+
+# Root directory of the repository, where the application is run from
+ROOT_DIRECTORY = Path(__file__).resolve().parents[1]
 
 
 def pytest_sessionstart(session: pytest.Session) -> None:
@@ -19,3 +34,188 @@ def patch_flask_redirect(mocker: MockerFixture) -> MockerFixture:
 def patch_requests_get(session_mocker: MockerFixture) -> MockerFixture:
     """Patch the ``request.get`` function."""
     return session_mocker.patch("requests.get")
+
+
+def get_free_port() -> int:
+    """Get a free TCP port on localhost."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+    return port
+
+
+def wait_for_app(url: str, timeout: float = 15.0) -> None:
+    """Wait until an application responds on its ``/cron`` page.
+
+    A ``requests.Session`` is used, as ``requests.get`` may be patched by the
+    ``patch_requests_get`` fixture.
+
+    """
+    deadline = time.monotonic() + timeout
+    session = requests.Session()
+    while time.monotonic() < deadline:
+        try:
+            if session.get(f"{url}/cron", timeout=1).status_code == 200:
+                return
+        except requests.ConnectionError:
+            pass
+        time.sleep(0.1)
+    raise TimeoutError(f"Application at {url} did not start")
+
+
+@pytest.fixture
+def start_app_nodes() -> Iterator[Callable[..., List[str]]]:
+    """Start several instances of the application, each on its own local port.
+
+    Yields a factory taking the number of nodes, and any extra environmental
+    variables; ``CLUSTER_NODE``, and ``CLUSTER_NODES`` are set automatically. All
+    instances are terminated on teardown.
+
+    """
+    processes: List["subprocess.Popen[bytes]"] = []
+
+    def factory(count: int, **extra_env: str) -> List[str]:
+        urls = [f"http://127.0.0.1:{get_free_port()}" for _ in range(count)]
+        for url in urls:
+            env = {
+                **os.environ,
+                **extra_env,
+                "CLUSTER_NODE": url,
+                "CLUSTER_NODES": ",".join(urls),
+            }
+            processes.append(
+                subprocess.Popen(  # noqa: S603
+                    [sys.executable, "-m", "flask", "--app", "main", "run"]
+                    + ["--port", url.rsplit(":", 1)[1]],
+                    cwd=ROOT_DIRECTORY,
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                )
+            )
+        for url in urls:
+            wait_for_app(url)
+        return urls
+
+    yield factory
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        _ = process.wait(timeout=10)
+
+
+@pytest.fixture
+def start_gunicorn(
+    tmp_path: Path,
+) -> Iterator[Callable[..., Tuple[str, "subprocess.Popen[bytes]"]]]:
+    """Start the application with gunicorn, and ``gunicorn.conf.py``.
+
+    Yields a factory taking any extra environmental variables, and returning the base
+    URL, and the gunicorn arbiter process. Its log is written to ``gunicorn.log`` in
+    the ``tmp_path`` directory. The arbiter is terminated on teardown.
+
+    """
+    processes: List["subprocess.Popen[bytes]"] = []
+
+    def factory(**extra_env: str) -> Tuple[str, "subprocess.Popen[bytes]"]:
+        port = get_free_port()
+        env = {**os.environ, **extra_env, "PORT": str(port)}
+        with (tmp_path / "gunicorn.log").open("ab") as log:
+            processes.append(
+                subprocess.Popen(  # noqa: S603
+                    [sys.executable, "-m", "gunicorn", "main:app"]
+                    + ["--config", "gunicorn.conf.py"],
+                    cwd=ROOT_DIRECTORY,
+                    env=env,
+                    stdout=subprocess.DEVNULL,
+                    stderr=log,
+                )
+            )
+        url = f"http://127.0.0.1:{port}"
+        wait_for_app(url)
+        return url, processes[-1]
+
+    yield factory
+
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        _ = process.wait(timeout=60)
+
+
+@pytest.fixture
+def start_stub_server() -> Iterator[Callable[[Callable[..., Iterable[bytes]]], str]]:
+    """Start local stub HTTP servers in background threads.
+
+    Yields a factory taking a WSGI application, and returning the base URL of the
+    server running it. All servers are shut down on teardown.
+
+    """
+    servers: List[Any] = []
+
+    def factory(wsgi_app: Callable[..., Iterable[bytes]]) -> str:
+        server = make_server("127.0.0.1", 0, wsgi_app, threaded=True)
+        Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield factory
+
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+def stub_shields_io(start_stub_server: Callable[..., str]) -> str:
+    """Start a local stub of Shields.IO, returning an empty SVG badge for any path."""
+
+    def shields_io(environ: Any, start_response: Callable[..., Any]) -> List[bytes]:
+        start_response("200 OK", [("Content-Type", "image/svg+xml")])
+        return [b"<svg xmlns='http://www.w3.org/2000/svg'/>"]
+
+    return start_stub_server(shields_io)
+
+
+class CountAPIStub:
+    """Local stub of the CountAPI HTTP interface, holding counts in a dictionary.
+
+    Supports the ``hit``, ``get``, and ``set`` endpoints, and records every request
+    path. Set ``fail_after`` to make ``set`` requests fail with HTTP 500 once that
+    many have succeeded.
+
+    """
+
+    def __init__(self) -> None:
+        self.counts: Dict[Tuple[str, str], int] = {}
+        self.paths: List[str] = []
+        self.fail_after: Any = None
+
+    def __call__(self, environ: Any, start_response: Callable[..., Any]) -> Any:
+        """Handle a CountAPI request as a WSGI application."""
+        request = Request(environ)
+        self.paths.append(request.path)
+        action, namespace, key = request.path.strip("/").split("/")
+        value = self.counts.get((namespace, key))
+
+        if action == "hit":
+            value = self.counts[(namespace, key)] = (value or 0) + 1
+        elif action == "set":
+            if self.fail_after is not None:
+                if self.fail_after <= 0:
+                    return WerkzeugResponse(status=500)(environ, start_response)
+                self.fail_after -= 1
+            value = self.counts[(namespace, key)] = int(request.args["value"])
+        response = WerkzeugResponse(
+            json.dumps({"value": value}),
+            status=404 if value is None else 200,
+            content_type="application/json",
+        )
+        return response(environ, start_response)
+
+
+@pytest.fixture
+def stub_countapi(start_stub_server: Callable[..., str]) -> Tuple[str, CountAPIStub]:
+    """Start a local stub of CountAPI, returning its base URL, and the stub."""
+    stub = CountAPIStub()
+    return start_stub_server(stub), stub
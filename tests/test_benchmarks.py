@@ -0,0 +1,88 @@
+import json
+from pathlib import Path
+from typing import Dict
+
+import pytest
+from pytest_mock import MockerFixture
+
+from benchmarks.hot_path import (
+    compare_results,
+    get_benchmarks,
+    main_cli,
+    run_benchmarks,
+)
+
+# Define a baseline used across the tests
+BASELINE = {
+    "foo": {"ops_per_sec": 1000.0, "relative_speed": 2.0, "peak_bytes_per_call": 500.0}
+}
+
+
+@pytest.mark.parametrize(
+    "test_input, test_expected",
+    [
+        (
+            {"ops_per_sec": 900.0, "relative_speed": 1.8, "peak_bytes_per_call": 520.0},
+            {},
+        ),
+        (
+            {"ops_per_sec": 400.0, "relative_speed": 2.0, "peak_bytes_per_call": 500.0},
+            {},
+        ),
+        (
+            {
+                "ops_per_sec": 1000.0,
+                "relative_speed": 1.4,
+                "peak_bytes_per_call": 500.0,
+            },
+            {"foo": "relative_speed"},
+        ),
+        (
+            {
+                "ops_per_sec": 1000.0,
+                "relative_speed": 2.0,
+                "peak_bytes_per_call": 550.0,
+            },
+            {"foo": "peak_bytes"},
+        ),
+    ],
+)
+def test_compare_results_flags_regressions(
+    test_input: Dict[str, float], test_expected: Dict[str, str]
+) -> None:
+    """Test ``compare_results`` flags relatively slower, or larger, results.
+
+    Absolute operations per second depend on the machine, so are not compared.
+
+    """
+    regressions = compare_results({"foo": test_input}, BASELINE, 0.25)
+    assert regressions.keys() == test_expected.keys()
+    for name, prefix in test_expected.items():
+        assert regressions[name].startswith(prefix)
+
+
+def test_compare_results_ignores_benchmarks_not_in_baseline() -> None:
+    """Test new benchmarks without a baseline are not flagged."""
+    result = {"bar": {"relative_speed": 1.0, "peak_bytes_per_call": 1e9}}
+    assert compare_results(result, BASELINE, 0.25) == {}
+
+
+def test_run_benchmarks_measures_every_benchmark() -> None:
+    """Test ``run_benchmarks`` returns results for every benchmark."""
+    results = run_benchmarks(repeat=1)
+    assert results.keys() == get_benchmarks().keys()
+    assert all(r["ops_per_sec"] > 0 for r in results.values())
+    assert all(r["relative_speed"] > 0 for r in results.values())
+
+
+def test_main_cli_honours_zero_tolerances(
+    mocker: MockerFixture, tmp_path: Path
+) -> None:
+    """Test explicit zero tolerances override the tolerances in the baseline."""
+    _ = mocker.patch("benchmarks.hot_path.run_benchmarks", return_value=BASELINE)
+    baseline = tmp_path / "baseline.json"
+    _ = baseline.write_text(json.dumps({"tolerance": 0.5, "memory_tolerance": 0.5}))
+    argv = ["--update", "--baseline", str(baseline)]
+    assert main_cli(argv + ["--tolerance", "0", "--memory-tolerance", "0"]) == 0
+    stored = json.loads(baseline.read_text())
+    assert (stored["tolerance"], stored["memory_tolerance"]) == (0.0, 0.0)
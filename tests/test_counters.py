@@ -0,0 +1,94 @@
+from pathlib import Path
+from typing import Any
+from unittest.mock import MagicMock
+
+import pytest
+
+from counters import CountAPIBackend, LogBackend, MemoryBackend, get_counter_backend
+
+
+class TestCountAPIBackend:
+    @pytest.mark.parametrize("test_input", ["foo", "bar", "user_1234"])
+    def test_hit_calls_countapi_correctly(
+        self,
+        patch_requests_get: MagicMock,
+        test_input: str,
+    ) -> None:
+        """Test ``hit`` calls CountAPI with the key appended to the URL."""
+        _ = CountAPIBackend("https://example.com/hit/namespace/").hit(test_input)
+        patch_requests_get.assert_called_with(
+            f"https://example.com/hit/namespace/{test_input}"
+        )
+
+    def test_get_raises_for_non_hit_url(self) -> None:
+        """Test ``get`` raises a ``ValueError`` if the URL is not a ``hit`` URL."""
+        with pytest.raises(ValueError, match="Not a CountAPI hit URL"):
+            _ = CountAPIBackend("https://example.com/get/namespace").get("foo")
+
+    def test_add_not_supported(self) -> None:
+        """Test ``add`` raises a ``NotImplementedError``."""
+        with pytest.raises(NotImplementedError):
+            _ = CountAPIBackend("https://example.com").add("foo", 1)
+
+    def test_items_not_supported(self) -> None:
+        """Test ``items`` raises a ``NotImplementedError``."""
+        with pytest.raises(NotImplementedError):
+            _ = CountAPIBackend("https://example.com").items()
+
+
+class TestMemoryBackend:
+    def test_hit_increments_count(self) -> None:
+        """Test ``hit`` increments the count by one each time."""
+        backend = MemoryBackend()
+        assert [backend.hit("foo") for _ in range(3)] == [1, 2, 3]
+        assert backend.hit("bar") == 1
+
+    def test_add_removes_key_at_zero(self) -> None:
+        """Test ``add`` applies deltas, and removes keys that reach zero."""
+        backend = MemoryBackend()
+        assert backend.add("foo", 5) == 5
+        assert backend.add("bar", 2) == 2
+        assert backend.add("foo", -5) == 0
+        assert list(backend.items()) == [("bar", 2)]
+
+
+class TestLogBackend:
+    def test_counts_persist_after_closing(self, tmp_path: Path) -> None:
+        """Test counts are kept in the visit log after the backend is closed."""
+        key = "ab" * 32
+        backend = LogBackend(str(tmp_path))
+        assert [backend.hit(key) for _ in range(3)] == [1, 2, 3]
+        backend.set("cd" * 32, 5)
+        assert backend.add(key, -1) == 2
+        backend.close()
+
+        backend = LogBackend(str(tmp_path))
+        assert sorted(backend.items()) == [(key, 2), ("cd" * 32, 5)]
+        assert backend.get(key) == 2
+        backend.close()
+
+    def test_hit_raises_for_non_page_hash_keys(self, tmp_path: Path) -> None:
+        """Test ``hit`` raises a ``ValueError`` if the key is not a page hash."""
+        backend = LogBackend(str(tmp_path))
+        with pytest.raises(ValueError, match="64 hexadecimal characters"):
+            _ = backend.hit("foo")
+        backend.close()
+
+
+@pytest.mark.parametrize(
+    "test_input, test_expected",
+    [("countapi", CountAPIBackend), ("memory", MemoryBackend), ("log", LogBackend)],
+)
+def test_get_counter_backend_returns_correctly(
+    tmp_path: Path, test_input: str, test_expected: Any
+) -> None:
+    """Test ``get_counter_backend`` returns the correct backend class."""
+    backend = get_counter_backend(test_input, "https://example.com", str(tmp_path))
+    assert isinstance(backend, test_expected)
+    backend.close()
+
+
+def test_get_counter_backend_raises_for_unknown_name() -> None:
+    """Test ``get_counter_backend`` raises a ``ValueError`` for an unknown name."""
+    with pytest.raises(ValueError, match="Unknown counter backend"):
+        _ = get_counter_backend("foo", "https://example.com")
@@ -0,0 +1,158 @@
+import runpy
+import signal
+import subprocess  # noqa: S404
+import threading
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Tuple
+
+import pytest
+import requests
+from pytest_mock import MockerFixture
+
+# Path to the gunicorn configuration file
+GUNICORN_CONF = str(Path(__file__).resolve().parents[1] / "gunicorn.conf.py")
+
+
+def load_config(monkeypatch: pytest.MonkeyPatch, **env: str) -> Dict[str, Any]:
+    """Load the gunicorn configuration with the given environmental variables.
+
+    Live count streams are disabled, their default, unless ``STREAM_MAX_PAGES`` is
+    given.
+
+    """
+    for name in [
+        "COUNTER_BACKEND",
+        "CLUSTER_NODE",
+        "STREAM_MAX_PAGES",
+        "WEB_CONCURRENCY",
+    ]:
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr("multiprocessing.cpu_count", lambda: 4)
+    return runpy.run_path(GUNICORN_CONF)
+
+
+@pytest.mark.parametrize(
+    "test_input_profile, test_expected",
+    [
+        ("sync", ("sync", 9, 1)),
+        ("gthread", ("gthread", 5, 16)),
+        ("gevent", ("gevent", 4, 1)),
+    ],
+)
+def test_profiles_tune_workers_from_cpu_count(
+    monkeypatch: pytest.MonkeyPatch, test_input_profile: str, test_expected: Any
+) -> None:
+    """Test each profile sets its worker class, and scales workers by CPU count."""
+    config = load_config(monkeypatch, GUNICORN_PROFILE=test_input_profile)
+    assert (config["worker_class"], config["workers"], config["threads"]) == (
+        test_expected
+    )
+    assert config["preload_app"] is False
+
+
+def test_web_concurrency_overrides_workers(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test ``WEB_CONCURRENCY`` overrides the number of workers."""
+    config = load_config(monkeypatch, GUNICORN_PROFILE="gevent", WEB_CONCURRENCY="2")
+    assert config["workers"] == 2
+
+
+@pytest.mark.parametrize(
+    "test_input_env", [{"COUNTER_BACKEND": "memory"}, {"CLUSTER_NODE": "http://a"}]
+)
+def test_stateful_backends_run_a_single_worker(
+    monkeypatch: pytest.MonkeyPatch, test_input_env: Dict[str, str]
+) -> None:
+    """Test in-memory backends, and cluster nodes, run one worker with more threads."""
+    config = load_config(
+        monkeypatch, GUNICORN_PROFILE="gthread", WEB_CONCURRENCY="8", **test_input_env
+    )
+    assert (config["workers"], config["threads"]) == (1, 80)
+
+
+def test_streams_run_a_single_gevent_worker(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test enabling live count streams defaults to one ``gevent`` worker."""
+    monkeypatch.delenv("GUNICORN_PROFILE", raising=False)
+    config = load_config(monkeypatch, STREAM_MAX_PAGES="20", WEB_CONCURRENCY="8")
+    assert (config["worker_class"], config["workers"]) == ("gevent", 1)
+
+
+@pytest.mark.parametrize("test_input_profile", ["sync", "gthread"])
+def test_streams_reject_other_profiles(
+    monkeypatch: pytest.MonkeyPatch, test_input_profile: str
+) -> None:
+    """Test enabling live count streams with a profile other than gevent raises."""
+    with pytest.raises(ValueError, match="need the gevent profile"):
+        _ = load_config(
+            monkeypatch, GUNICORN_PROFILE=test_input_profile, STREAM_MAX_PAGES="20"
+        )
+
+
+def test_default_profile_without_streams_is_gthread(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    """Test the default profile is ``gthread`` if live count streams are disabled."""
+    monkeypatch.delenv("GUNICORN_PROFILE", raising=False)
+    config = load_config(monkeypatch)
+    assert (config["worker_class"], config["workers"]) == ("gthread", 5)
+
+
+def test_unknown_profile_raises(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test an unknown profile raises a ``ValueError``."""
+    with pytest.raises(ValueError, match="Unknown gunicorn profile"):
+        _ = load_config(monkeypatch, GUNICORN_PROFILE="foo")
+
+
+def test_closes_streams_on_shutdown(
+    monkeypatch: pytest.MonkeyPatch, mocker: MockerFixture
+) -> None:
+    """Test live count streams are closed once the worker is told to shut down."""
+    config = load_config(monkeypatch)
+    patch_close_streams = mocker.patch("main.close_streams")
+    worker = SimpleNamespace(alive=True)
+    timer = threading.Timer(0.2, setattr, (worker, "alive", False))
+    timer.start()
+    config["close_streams_on_shutdown"](worker)
+    timer.join()
+    patch_close_streams.assert_called_once_with()
+
+
+def test_reload_with_open_stream_replaces_worker(
+    start_gunicorn: Callable[..., Tuple[str, "subprocess.Popen[bytes]"]],
+    tmp_path: Path,
+) -> None:
+    """Test a graceful reload closes open streams, and the new worker takes over.
+
+    The old worker must close its streams, and visit log, well before the new worker
+    would be killed by gunicorn's worker timeout waiting to open the log.
+
+    """
+    url, process = start_gunicorn(
+        COUNTER_BACKEND="log",
+        LOG_DIRECTORY=str(tmp_path / "visits"),
+        STREAM_MAX_PAGES="20",
+    )
+    session = requests.Session()
+    with session.get(
+        f"{url}/stream", params={"page": "foo"}, stream=True, timeout=30
+    ) as stream:
+        events = stream.iter_lines(delimiter=b"\n\n")
+        assert next(events).startswith(b"event: count")
+
+        # Reload, and assert the stream is closed at once, not at the graceful timeout
+        start = time.monotonic()
+        process.send_signal(signal.SIGHUP)
+        for _ in events:
+            pass
+        assert time.monotonic() - start < 5
+
+    # Wait for the old worker to stop accepting requests, and assert the new worker
+    # serves them long before the worker timeout
+    time.sleep(1.5)
+    response = requests.Session().get(f"{url}/cron", timeout=20)
+    assert response.status_code == 200
+    assert time.monotonic() - start < 20
+    assert b"WORKER TIMEOUT" not in (tmp_path / "gunicorn.log").read_bytes()
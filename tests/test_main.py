@@ -1,4 +1,5 @@
 import os
+import threading
 from datetime import timedelta
 from http import HTTPStatus
 from typing import Any, Dict, Optional, Union
@@ -9,15 +10,26 @@ import pytest
 from flask import render_template, request
 from pytest_mock import MockerFixture
 
+import main
 from main import (
+    ADMIN_SECRET_HEADER,
+    BROKER,
+    CLUSTER_SESSION,
     app,
+    close_streams,
     combine_url_and_query,
     compile_shields_io_url,
     cron_page,
     get_page_count,
     get_page_hash,
+    init_worker,
     redirect_to_github_repository,
+    shutdown_worker,
 )
+from pubsub import Broker
+from referrers import ReferrerTracker
+from replication import GCounterBackend
+from sharding import CLUSTER_HOPS_HEADER, CLUSTER_SECRET_HEADER, HashRing
 
 # Import environmental variables
 DEFAULT_SHIELDS_IO_LABEL = os.environ["DEFAULT_SHIELDS_IO_LABEL"]
@@ -200,6 +212,219 @@ def test_get_page_count_returns_correctly_with_failing_countapi(
     assert get_page_count("test_key") is None
 
 
+def test_get_page_count_forwards_keys_owned_by_other_nodes(
+    mocker: MockerFixture,
+) -> None:
+    """Test ``get_page_count`` forwards a hit to the node owning the key."""
+    # Patch the cluster settings, so another node owns every key
+    _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+    _ = mocker.patch("main.CLUSTER_RING", HashRing(["http://node-b"]))
+    _ = mocker.patch("main.CLUSTER_SECRET", "secret")
+    patch_forward_hit = mocker.patch("main.forward_hit", return_value=5)
+    patch_counter = mocker.patch("main.COUNTER")
+
+    # Assert the hit is forwarded, and not counted locally
+    assert get_page_count("test_key") == 5
+    patch_forward_hit.assert_called_once_with(
+        CLUSTER_SESSION, "http://node-b", "test_key", "secret"
+    )
+    patch_counter.hit.assert_not_called()
+
+
+def test_get_page_count_publishes_new_counts(mocker: MockerFixture) -> None:
+    """Test ``get_page_count`` publishes the new count to live count streams."""
+    _ = mocker.patch("main.COUNTER.hit", return_value=3)
+    subscription = BROKER.subscribe(["test_key"])
+    try:
+        assert get_page_count("test_key") == 3
+        assert subscription.wait(0) == {"test_key": 3}
+    finally:
+        BROKER.unsubscribe(subscription)
+
+
+def test_get_page_count_counts_owned_keys_locally(mocker: MockerFixture) -> None:
+    """Test ``get_page_count`` counts a hit locally if this node owns the key."""
+    # Patch the cluster settings, so this node owns every key
+    _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+    _ = mocker.patch("main.CLUSTER_RING", HashRing(["http://node-a"]))
+    patch_forward_hit = mocker.patch("main.forward_hit")
+    patch_counter = mocker.patch("main.COUNTER")
+
+    # Assert the hit is counted locally, and not forwarded
+    assert get_page_count("test_key") == patch_counter.hit.return_value
+    patch_forward_hit.assert_not_called()
+
+
+@pytest.mark.parametrize(
+    "test_input_hops, test_expected_forwarded",
+    [(None, True), ("1", True), ("2", False)],
+)
+def test_hit_owned_page_count_forwards_keys_it_no_longer_owns(
+    mocker: MockerFixture,
+    test_input_hops: Optional[str],
+    test_expected_forwarded: bool,
+) -> None:
+    """Test hits for keys owned by another node are forwarded on, up to a hop limit."""
+    # Patch the cluster settings, so another node owns every key on this node's ring
+    _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+    _ = mocker.patch("main.CLUSTER_RING", HashRing(["http://node-b"]))
+    _ = mocker.patch("main.CLUSTER_SECRET", "secret")
+    patch_forward_hit = mocker.patch("main.forward_hit", return_value=5)
+    patch_counter = mocker.patch("main.COUNTER")
+    patch_counter.hit.return_value = 1
+
+    # Send a forwarded hit
+    headers = {CLUSTER_SECRET_HEADER: "secret"}
+    if test_input_hops is not None:
+        headers[CLUSTER_HOPS_HEADER] = test_input_hops
+    response = app.test_client().post("/internal/count/foo", headers=headers)
+
+    # Assert the hit is forwarded to the owner, or counted locally at the hop limit
+    if test_expected_forwarded:
+        assert response.get_json() == {"value": 5}
+        patch_forward_hit.assert_called_once_with(
+            CLUSTER_SESSION, "http://node-b", "foo", "secret", hops=2
+        )
+        patch_counter.hit.assert_not_called()
+    else:
+        assert response.get_json() == {"value": 1}
+        patch_forward_hit.assert_not_called()
+
+
+def test_exchange_gossip_publishes_merged_counts(mocker: MockerFixture) -> None:
+    """Test merged gossip is published to live count streams."""
+    _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+    _ = mocker.patch("main.CLUSTER_SECRET", "secret")
+    counter = GCounterBackend("http://node-a", ["http://node-b"])
+    _ = counter.hit("foo")
+    _ = mocker.patch("main.COUNTER", counter)
+    subscription = BROKER.subscribe(["foo", "bar"])
+    try:
+        response = app.test_client().post(
+            "/internal/gossip",
+            json={"counts": {"foo": {"http://node-b": 2}, "bar": {}}},
+            headers={CLUSTER_SECRET_HEADER: "secret"},
+        )
+        assert response.get_json() == {"changed": 1}
+        assert subscription.wait(0) == {"foo": 3}
+    finally:
+        BROKER.unsubscribe(subscription)
+
+
+@pytest.mark.parametrize(
+    "test_input_count, test_expected_status", [(None, 404), (3, 200)]
+)
+def test_hit_owned_page_count_gets_count(
+    mocker: MockerFixture,
+    test_input_count: Optional[int],
+    test_expected_status: int,
+) -> None:
+    """Test a ``GET`` for the local count returns HTTP 404 if there is no count."""
+    _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+    _ = mocker.patch("main.CLUSTER_SECRET", "secret")
+    _ = mocker.patch("main.COUNTER.get", return_value=test_input_count)
+    response = app.test_client().get(
+        "/internal/count/foo", headers={CLUSTER_SECRET_HEADER: "secret"}
+    )
+    assert response.status_code == test_expected_status
+    if test_input_count is not None:
+        assert response.get_json() == {"value": test_input_count}
+
+
+class TestWatchPageCounts:
+    @pytest.fixture(autouse=True)
+    def enable_streams(self, mocker: MockerFixture) -> None:
+        """Enable live count streams on a cluster node."""
+        _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+        _ = mocker.patch("main.CLUSTER_SECRET", "secret")
+        _ = mocker.patch("main.STREAM_MAX_PAGES", 20)
+        _ = mocker.patch("main.STREAM_HEARTBEAT", 5)
+
+    @pytest.mark.parametrize(
+        "test_input_payload",
+        [{}, {"counts": {}, "wait": 1}, {"counts": {"foo": "1"}, "wait": 1}],
+    )
+    def test_bad_request_if_payload_invalid(
+        self, test_input_payload: Dict[str, Any]
+    ) -> None:
+        """Test HTTP 400 is returned if the counts, or wait are invalid."""
+        response = app.test_client().post(
+            "/internal/watch",
+            json=test_input_payload,
+            headers={CLUSTER_SECRET_HEADER: "secret"},
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_returns_changed_counts_immediately(self, mocker: MockerFixture) -> None:
+        """Test counts differing from the last known counts are returned at once."""
+        _ = mocker.patch("main.COUNTER.get", side_effect=lambda k: len(k))
+        response = app.test_client().post(
+            "/internal/watch",
+            json={"counts": {"foo": 3, "quux": None, "bar": 1}, "wait": 5},
+            headers={CLUSTER_SECRET_HEADER: "secret"},
+        )
+        assert response.get_json() == {"counts": {"quux": 4, "bar": 3}}
+        assert len(BROKER) == 0
+
+    def test_waits_for_published_changes(self, mocker: MockerFixture) -> None:
+        """Test published changes are returned if the counts are up to date."""
+        _ = mocker.patch("main.COUNTER.get", return_value=3)
+        timer = threading.Timer(0.1, BROKER.publish, ("foo", 4))
+        timer.start()
+        response = app.test_client().post(
+            "/internal/watch",
+            json={"counts": {"foo": 3}, "wait": 5},
+            headers={CLUSTER_SECRET_HEADER: "secret"},
+        )
+        timer.join()
+        assert response.get_json() == {"counts": {"foo": 4}}
+
+
+@pytest.mark.parametrize(
+    "test_input_method, test_input_path",
+    [
+        ("post", "/internal/count/foo"),
+        ("post", "/internal/counts"),
+        ("post", "/internal/watch"),
+        ("put", "/internal/nodes"),
+        ("get", "/internal/gossip"),
+        ("post", "/internal/gossip/flush"),
+    ],
+)
+class TestInternalClusterRoutes:
+    def test_not_found_if_not_clustered(
+        self, test_input_method: str, test_input_path: str
+    ) -> None:
+        """Test internal routes return HTTP 404 if not running as a cluster."""
+        client = app.test_client()
+        response = getattr(client, test_input_method)(test_input_path, json={})
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_forbidden_with_wrong_secret(
+        self, mocker: MockerFixture, test_input_method: str, test_input_path: str
+    ) -> None:
+        """Test internal routes return HTTP 403 with the wrong cluster secret."""
+        _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+        _ = mocker.patch("main.CLUSTER_SECRET", "secret")
+        client = app.test_client()
+        response = getattr(client, test_input_method)(
+            test_input_path, json={}, headers={CLUSTER_SECRET_HEADER: "wrong"}
+        )
+        assert response.status_code == HTTPStatus.FORBIDDEN
+
+    def test_forbidden_with_non_ascii_secret(
+        self, mocker: MockerFixture, test_input_method: str, test_input_path: str
+    ) -> None:
+        """Test internal routes return HTTP 403, not 500, with a non-ASCII secret."""
+        _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+        _ = mocker.patch("main.CLUSTER_SECRET", "secret")
+        client = app.test_client()
+        response = getattr(client, test_input_method)(
+            test_input_path, json={}, headers={CLUSTER_SECRET_HEADER: "é"}
+        )
+        assert response.status_code == HTTPStatus.FORBIDDEN
+
+
 @pytest.mark.parametrize(
     "test_input_label, test_input_message, test_input_color, test_input_query",
     [
@@ -605,6 +830,259 @@ class TestGetShieldsIoBadge:
         )
 
 
+class TestStreamPageCounts:
+    @pytest.fixture(autouse=True)
+    def enable_streams(self, mocker: MockerFixture) -> None:
+        """Enable live count streams, which are off by default."""
+        _ = mocker.patch("main.STREAM_MAX_PAGES", 20)
+
+    @pytest.mark.parametrize(
+        "test_input_query, test_expected",
+        [
+            ({}, "Missing required argument: page"),
+            ({"page": [f"page_{i}" for i in range(21)]}, "Too many pages"),
+        ],
+    )
+    def test_bad_request_if_pages_invalid(
+        self, test_input_query: Dict[str, Any], test_expected: str
+    ) -> None:
+        """Test HTTP 400 is returned if there are no pages, or too many pages."""
+        response = app.test_client().get("/stream", query_string=test_input_query)
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+        assert response.get_data(as_text=True).startswith(test_expected)
+
+    def test_not_found_if_streams_disabled(self, mocker: MockerFixture) -> None:
+        """Test HTTP 404 is returned if ``STREAM_MAX_PAGES`` is zero."""
+        _ = mocker.patch("main.STREAM_MAX_PAGES", 0)
+        response = app.test_client().get("/stream", query_string={"page": "foo"})
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_streams_coalesced_count_changes(self, mocker: MockerFixture) -> None:
+        """Test the current counts are sent, followed by coalesced count changes."""
+        # Patch the counter backend with the current counts
+        _ = mocker.patch("main.COUNTER.get", return_value=0)
+        _ = mocker.patch("main.get_page_hash", side_effect=lambda p: p * 64)
+        response = app.test_client().get(
+            "/stream", query_string={"page": ["foo", "bar"]}
+        )
+        assert response.content_type == "text/event-stream"
+        events = iter(response.response)
+
+        # Assert the initial counts are sent, and the stream is subscribed
+        assert next(events) == b'event: count\ndata: {"foo": 0, "bar": 0}\n\n'
+        assert len(BROKER) == 2
+
+        # Publish several changes, and assert they are sent as one event
+        for count in range(1, 4):
+            BROKER.publish(("foo" * 64)[:64], count)
+        BROKER.publish(("bar" * 64)[:64], 9)
+        assert next(events) == b'event: count\ndata: {"foo": 3, "bar": 9}\n\n'
+
+        # Assert the stream unsubscribes once closed
+        response.close()
+        assert len(BROKER) == 0
+
+    def test_reads_initial_counts_from_owner_nodes(self, mocker: MockerFixture) -> None:
+        """Test initial counts for keys owned by another node are read from it."""
+        # Patch the cluster settings, so another node owns every key
+        _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+        _ = mocker.patch("main.CLUSTER_RING", HashRing(["http://node-b"]))
+        _ = mocker.patch("main.CLUSTER_SECRET", "secret")
+        patch_fetch_count = mocker.patch("main.fetch_count", return_value=7)
+        _ = mocker.patch("main.watch_counts", return_value={})
+        patch_counter = mocker.patch("main.COUNTER")
+
+        # Assert the initial count is read from the owner, and not locally
+        response = app.test_client().get("/stream", query_string={"page": "foo"})
+        assert next(iter(response.response)) == b'event: count\ndata: {"foo": 7}\n\n'
+        response.close()
+        patch_fetch_count.assert_called_once_with(
+            CLUSTER_SESSION, "http://node-b", get_page_hash("foo")[:64], "secret"
+        )
+        patch_counter.get.assert_not_called()
+
+    def test_relays_changes_from_owner_nodes(self, mocker: MockerFixture) -> None:
+        """Test changes to keys owned by another node are relayed from it."""
+        # Patch the cluster settings, so another node owns every key, and has counted
+        # one more visit since the initial count was read
+        key = get_page_hash("foo")[:64]
+        _ = mocker.patch("main.CLUSTER_NODE", "http://node-a")
+        _ = mocker.patch("main.CLUSTER_RING", HashRing(["http://node-b"]))
+        _ = mocker.patch("main.fetch_count", return_value=7)
+        patch_watch_counts = mocker.patch("main.watch_counts", side_effect=[{key: 8}])
+
+        # Assert the change relayed from the owner is sent
+        response = app.test_client().get("/stream", query_string={"page": "foo"})
+        events = iter(response.response)
+        assert next(events) == b'event: count\ndata: {"foo": 7}\n\n'
+        assert next(events) == b'event: count\ndata: {"foo": 8}\n\n'
+        response.close()
+        assert patch_watch_counts.call_args_list[0][0][1] == "http://node-b"
+
+    def test_stream_ends_once_closed(self, mocker: MockerFixture) -> None:
+        """Test streams end, and new ones are empty, once streams are closed."""
+        _ = mocker.patch("main.COUNTER.get", return_value=0)
+        _ = mocker.patch("main.BROKER", Broker())
+        response = app.test_client().get("/stream", query_string={"page": "foo"})
+        events = iter(response.response)
+        _ = next(events)
+        close_streams()
+        assert list(events) == []
+        response = app.test_client().get("/stream", query_string={"page": "foo"})
+        assert list(response.response) == [b'event: count\ndata: {"foo": 0}\n\n']
+
+    def test_sends_heartbeat_if_idle(self, mocker: MockerFixture) -> None:
+        """Test a keep-alive comment is sent if no counts change."""
+        _ = mocker.patch("main.COUNTER.get", return_value=None)
+        _ = mocker.patch("main.STREAM_HEARTBEAT", 0)
+        response = app.test_client().get("/stream", query_string={"page": "foo"})
+        events = iter(response.response)
+        _ = next(events)
+        assert next(events) == b": keep-alive\n\n"
+        response.close()
+
+
+class TestGetPageReferrers:
+    def test_not_found_without_admin_secret(self) -> None:
+        """Test HTTP 404 is returned if no admin secret is set."""
+        response = app.test_client().get("/admin/referrers", query_string={"page": "a"})
+        assert response.status_code == HTTPStatus.NOT_FOUND
+
+    def test_forbidden_with_wrong_secret(self, mocker: MockerFixture) -> None:
+        """Test HTTP 403 is returned with the wrong admin secret."""
+        _ = mocker.patch("main.ADMIN_SECRET", "secret")
+        response = app.test_client().get(
+            "/admin/referrers",
+            query_string={"page": "a"},
+            headers={ADMIN_SECRET_HEADER: "wrong"},
+        )
+        assert response.status_code == HTTPStatus.FORBIDDEN
+
+    def test_forbidden_with_non_ascii_secret(self, mocker: MockerFixture) -> None:
+        """Test HTTP 403, not 500, is returned with a non-ASCII admin secret."""
+        _ = mocker.patch("main.ADMIN_SECRET", "secret")
+        response = app.test_client().get(
+            "/admin/referrers",
+            query_string={"page": "a"},
+            headers={ADMIN_SECRET_HEADER: "é"},
+        )
+        assert response.status_code == HTTPStatus.FORBIDDEN
+
+    def test_bad_request_without_page(self, mocker: MockerFixture) -> None:
+        """Test HTTP 400 is returned if the page argument is missing."""
+        _ = mocker.patch("main.ADMIN_SECRET", "secret")
+        response = app.test_client().get(
+            "/admin/referrers", headers={ADMIN_SECRET_HEADER: "secret"}
+        )
+        assert response.status_code == HTTPStatus.BAD_REQUEST
+
+    def test_badge_visits_are_counted_per_referrer(self, mocker: MockerFixture) -> None:
+        """Test ``/badge`` visits are counted against their normalised referrer."""
+        _ = mocker.patch("main.ADMIN_SECRET", "secret")
+        _ = mocker.patch("main.REFERRERS", ReferrerTracker(256, 4, 10))
+        _ = mocker.patch("main.get_page_count", return_value=1)
+        _ = mocker.patch("main.compile_shields_io_url")
+        client = app.test_client()
+
+        # Visit the badge from several referrers, and without a referrer
+        for referrer in [
+            "https://github.com/foo",
+            "https://GitHub.com/bar",
+            "https://www.example.com/",
+            None,
+        ]:
+            headers = {"Referer": referrer} if referrer else {}
+            _ = client.get("/badge", query_string={"page": "foo"}, headers=headers)
+
+        # Assert the top referrers are returned
+        response = client.get(
+            "/admin/referrers",
+            query_string={"page": "foo"},
+            headers={ADMIN_SECRET_HEADER: "secret"},
+        )
+        assert response.get_json() == {
+            "page": "foo",
+            "total": 3,
+            "referrers": [
+                {"host": "github.com", "count": 2},
+                {"host": "example.com", "count": 1},
+            ],
+        }
+
+        # Assert counts for specific hosts are estimated, after normalising them
+        response = client.get(
+            "/admin/referrers",
+            query_string={"page": "foo", "host": ["WWW.Example.com", "other.com"]},
+            headers={ADMIN_SECRET_HEADER: "secret"},
+        )
+        assert response.get_json()["referrers"] == [
+            {"host": "example.com", "count": 1},
+            {"host": "other.com", "count": 0},
+        ]
+
+    def test_failed_counts_are_not_counted(self, mocker: MockerFixture) -> None:
+        """Test visits are not counted per referrer if the page count fails."""
+        patch_referrers = mocker.patch("main.REFERRERS")
+        _ = mocker.patch("main.get_page_count", return_value=None)
+        _ = mocker.patch("main.compile_shields_io_url")
+        _ = app.test_client().get(
+            "/badge",
+            query_string={"page": "foo"},
+            headers={"Referer": "https://github.com/"},
+        )
+        patch_referrers.add.assert_not_called()
+
+
+class TestWorkerLifecycle:
+    def test_init_worker_runs_once_per_process(self, mocker: MockerFixture) -> None:
+        """Test ``init_worker`` does nothing if already run in this process."""
+        _ = mocker.patch("main.WORKER_PID", os.getpid())
+        patch_create_session = mocker.patch("main.create_session")
+        init_worker()
+        patch_create_session.assert_not_called()
+
+    def test_init_worker_reinitialises_after_fork(self, mocker: MockerFixture) -> None:
+        """Test ``init_worker`` replaces inherited state in a forked process."""
+        # Patch the state as if inherited from a parent process with a G-counter
+        counter = GCounterBackend("http://node-a", ["http://node-b"])
+        _ = mocker.patch("main.WORKER_PID", -1)
+        _ = mocker.patch("main.COUNTER", counter)
+        _ = mocker.patch("main.CLUSTER_SESSION")
+        _ = mocker.patch("main.GOSSIPER")
+        patch_create_session = mocker.patch("main.create_session")
+        patch_gossiper = mocker.patch("main.Gossiper")
+
+        # Assert the session is replaced, and gossip started in the same slot
+        init_worker()
+        assert main.WORKER_PID == os.getpid()
+        assert main.CLUSTER_SESSION == patch_create_session.return_value
+        assert counter.replica == "http://node-a"
+        patch_gossiper.return_value.start.assert_called_once_with()
+
+    def test_shutdown_worker_stops_gossiper(self, mocker: MockerFixture) -> None:
+        """Test ``shutdown_worker`` stops, and flushes, the gossiper."""
+        _ = mocker.patch("main.WORKER_PID", os.getpid())
+        patch_gossiper = mocker.patch("main.GOSSIPER")
+        shutdown_worker()
+        patch_gossiper.stop.assert_called_once_with()
+
+    def test_shutdown_worker_closes_counter(self, mocker: MockerFixture) -> None:
+        """Test ``shutdown_worker`` closes the counter backend, syncing any changes."""
+        _ = mocker.patch("main.WORKER_PID", os.getpid())
+        patch_counter = mocker.patch("main.COUNTER")
+        shutdown_worker()
+        patch_counter.close.assert_called_once_with()
+
+    def test_shutdown_worker_ignores_other_processes(
+        self, mocker: MockerFixture
+    ) -> None:
+        """Test ``shutdown_worker`` does nothing if not initialised in this process."""
+        _ = mocker.patch("main.WORKER_PID", -1)
+        patch_counter = mocker.patch("main.COUNTER")
+        shutdown_worker()
+        patch_counter.close.assert_not_called()
+
+
 class TestCronPage:
     def test_returns_correct_status_code(self) -> None:
         """Test the `cron_page` function returns correctly."""
@@ -0,0 +1,273 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import pytest
+import requests
+from pytest_mock import MockerFixture
+
+from counters import MemoryBackend
+from main import get_page_hash
+from migrate import call_with_retries, fetch_counts, main, migrate, read_checkpoint
+from sharding import ClusterBackend
+
+# Define page hash keys used across the tests
+KEYS = [get_page_hash(f"page_{i}")[:64] for i in range(50)]
+
+
+class SlowMemoryBackend(MemoryBackend):
+    """Memory backend that records the largest number of concurrent reads."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.active, self.max_active = 0, 0
+
+    def get(self, key: str) -> Optional[int]:
+        """Get the count for a key, tracking concurrent calls."""
+        with self._lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            return super().get(key) or None
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def write_keys(path: Path, keys: List[str]) -> str:
+    """Write keys to a file, one per line, returning the file path."""
+    path.write_text("\n".join(keys) + "\n")
+    return str(path)
+
+
+def test_fetch_counts_yields_in_key_order() -> None:
+    """Test ``fetch_counts`` yields counts in key order, with a bounded window."""
+    backend = SlowMemoryBackend()
+    for i, key in enumerate(KEYS):
+        backend.set(key, i)
+
+    # Consume keys lazily, and assert no more than the window is read ahead
+    consumed: List[str] = []
+
+    def keys() -> Iterable[str]:
+        for key in KEYS:
+            consumed.append(key)
+            yield key
+
+    with ThreadPoolExecutor(4) as executor:
+        records = fetch_counts(backend, keys(), executor, 8)
+        assert next(records) == (KEYS[0], None)
+        assert len(consumed) == 8
+        assert list(records) == [(k, i) for i, k in enumerate(KEYS)][1:]
+    assert backend.max_active <= 4
+
+
+def http_error(status_code: int) -> requests.HTTPError:
+    """Create an HTTP error for a response with a status code."""
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError(response=response)
+
+
+@pytest.mark.parametrize(
+    "error", [requests.ConnectionError(), requests.Timeout(), http_error(503)]
+)
+def test_call_with_retries_retries_transient_failures(
+    mocker: MockerFixture, error: requests.RequestException
+) -> None:
+    """Test ``call_with_retries`` retries transient failures, with backoff."""
+    sleep = mocker.patch("migrate.time.sleep")
+    func = mocker.Mock(side_effect=[error, error, 5])
+
+    assert call_with_retries(func, "a", retries=2, backoff=1.0) == 5
+    func.assert_called_with("a")
+    first, second = (c.args[0] for c in sleep.call_args_list)
+    assert 0.5 <= first <= 1.5 and 1.0 <= second <= 3.0
+
+
+def test_call_with_retries_raises_after_retries(mocker: MockerFixture) -> None:
+    """Test ``call_with_retries`` raises once it runs out of retries."""
+    mocker.patch("migrate.time.sleep")
+    func = mocker.Mock(side_effect=http_error(429))
+
+    with pytest.raises(requests.HTTPError):
+        _ = call_with_retries(func, retries=3)
+    assert func.call_count == 4
+
+
+def test_call_with_retries_does_not_retry_client_errors(mocker: MockerFixture) -> None:
+    """Test ``call_with_retries`` raises client errors without retrying them."""
+    sleep = mocker.patch("migrate.time.sleep")
+    func = mocker.Mock(side_effect=http_error(400))
+
+    with pytest.raises(requests.HTTPError):
+        _ = call_with_retries(func)
+    assert func.call_count == 1
+    sleep.assert_not_called()
+
+
+def test_fetch_counts_retries_reads(mocker: MockerFixture) -> None:
+    """Test ``fetch_counts`` retries a read that fails transiently."""
+    mocker.patch("migrate.time.sleep")
+    backend = MemoryBackend()
+    backend.set("a", 1)
+    mocker.patch.object(
+        backend, "get", side_effect=[requests.Timeout(), backend.get("a")]
+    )
+
+    with ThreadPoolExecutor(1) as executor:
+        assert list(fetch_counts(backend, ["a"], executor, 1)) == [("a", 1)]
+
+
+def test_migrate_writes_batches_and_checkpoints(tmp_path: Path) -> None:
+    """Test ``migrate`` skips missing, or zero counts, and checkpoints every batch."""
+    destination = MemoryBackend()
+    checkpoint = str(tmp_path / "checkpoint.json")
+    records: List[Tuple[str, Optional[int]]] = [
+        ("a", 1),
+        ("b", None),
+        ("c", 3),
+        ("d", 0),
+    ]
+
+    result = migrate(records, destination, batch_size=2, checkpoint=checkpoint, start=5)
+    assert result._asdict() == {"position": 9, "written": 2, "skipped": 2}
+    assert sorted(destination.items()) == [("a", 1), ("c", 3)]
+    assert read_checkpoint(checkpoint) == 9
+
+
+def test_main_migrates_between_countapi_namespaces(
+    tmp_path: Path, stub_countapi: Tuple[str, Any]
+) -> None:
+    """Test the CLI migrates counts between two CountAPI namespaces."""
+    url, stub = stub_countapi
+    stub.counts.update({("source", k): i for i, k in enumerate(KEYS) if i % 5})
+
+    _ = main(
+        [
+            "--source=countapi",
+            f"--source-url={url}/hit/source",
+            f"--keys={write_keys(tmp_path / 'keys.txt', KEYS)}",
+            "--destination=countapi",
+            f"--destination-url={url}/hit/destination",
+            "--concurrency=4",
+            "--batch-size=7",
+        ]
+    )
+    assert {k: v for (n, k), v in stub.counts.items() if n == "destination"} == {
+        k: i for i, k in enumerate(KEYS) if i % 5
+    }
+
+
+def test_main_resumes_from_checkpoint(
+    tmp_path: Path,
+    stub_countapi: Tuple[str, Any],
+    capsys: pytest.CaptureFixture[str],
+    mocker: MockerFixture,
+) -> None:
+    """Test an interrupted migration resumes from its checkpoint."""
+    url, stub = stub_countapi
+    stub.counts.update({("source", k): i + 1 for i, k in enumerate(KEYS)})
+    args = [
+        "--source=countapi",
+        f"--source-url={url}/hit/source",
+        f"--keys={write_keys(tmp_path / 'keys.txt', KEYS)}",
+        "--destination=countapi",
+        f"--destination-url={url}/hit/destination",
+        "--concurrency=1",
+        "--batch-size=10",
+        f"--checkpoint={tmp_path / 'checkpoint.json'}",
+    ]
+
+    # Fail part way through the third batch, until the retries run out
+    mocker.patch("migrate.time.sleep")
+    stub.fail_after = 25
+    with pytest.raises(requests.HTTPError):
+        _ = main(args)
+    assert read_checkpoint(str(tmp_path / "checkpoint.json")) == 20
+
+    # Resume, and assert only keys from the checkpoint onwards are read again
+    stub.fail_after, stub.paths[:] = None, []
+    _ = main(args)
+    assert json.loads(capsys.readouterr().out) == {
+        "position": 50,
+        "written": 30,
+        "skipped": 0,
+    }
+    assert sum(p.startswith("/get/") for p in stub.paths) == 30
+    assert {k: v for (n, k), v in stub.counts.items() if n == "destination"} == {
+        k: i + 1 for i, k in enumerate(KEYS)
+    }
+
+
+def test_main_migrates_into_cluster(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    stub_countapi: Tuple[str, Any],
+    start_app_nodes: Callable[..., List[str]],
+) -> None:
+    """Test the CLI migrates counts from CountAPI into a sharded cluster."""
+    url, stub = stub_countapi
+    stub.counts.update({("source", k): i + 1 for i, k in enumerate(KEYS)})
+    nodes = start_app_nodes(2, COUNTER_BACKEND="memory", CLUSTER_SECRET="pytest")
+    monkeypatch.setenv("CLUSTER_SECRET", "pytest")
+
+    _ = main(
+        [
+            "--source=countapi",
+            f"--source-url={url}/hit/source",
+            f"--keys={write_keys(tmp_path / 'keys.txt', KEYS)}",
+            "--destination=cluster",
+            f"--destination-url={','.join(nodes)}",
+        ]
+    )
+    cluster = ClusterBackend(nodes, "pytest")
+    assert [cluster.get(k) for k in KEYS] == list(range(1, len(KEYS) + 1))
+
+
+@pytest.mark.parametrize("source", ["countapi", "cluster"])
+def test_main_requires_keys_for_unlisted_sources(
+    tmp_path: Path, capsys: pytest.CaptureFixture[str], source: str
+) -> None:
+    """Test the CLI rejects sources that cannot list keys without a keys file."""
+    destination = tmp_path / "log"
+    with pytest.raises(SystemExit) as exc_info:
+        _ = main(
+            [
+                f"--source={source}",
+                "--source-url=http://127.0.0.1:1/hit/source",
+                "--destination=log",
+                f"--destination-url={destination}",
+            ]
+        )
+    assert exc_info.value.code == 2
+    assert f"--keys is required for --source {source}" in capsys.readouterr().err
+    assert not destination.exists()
+
+
+def test_main_skips_keys_missing_from_cluster(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    stub_countapi: Tuple[str, Any],
+    start_app_nodes: Callable[..., List[str]],
+) -> None:
+    """Test the CLI skips keys a cluster source has no count for, without retrying."""
+    url, stub = stub_countapi
+    nodes = start_app_nodes(2, COUNTER_BACKEND="memory", CLUSTER_SECRET="pytest")
+    monkeypatch.setenv("CLUSTER_SECRET", "pytest")
+    ClusterBackend(nodes, "pytest").set_many({k: 1 for k in KEYS[:10]})
+
+    _ = main(
+        [
+            "--source=cluster",
+            f"--source-url={','.join(nodes)}",
+            f"--keys={write_keys(tmp_path / 'keys.txt', KEYS)}",
+            "--destination=countapi",
+            f"--destination-url={url}/hit/destination",
+            "--retries=0",
+        ]
+    )
+    assert {k: v for (n, k), v in stub.counts.items() if n == "destination"} == {
+        k: 1 for k in KEYS[:10]
+    }
@@ -0,0 +1,66 @@
+import threading
+
+from pubsub import Broker, Subscription
+
+
+class TestSubscription:
+    def test_wait_coalesces_updates(self) -> None:
+        """Test updates to a key between reads coalesce into the latest count."""
+        subscription = Subscription(["foo", "bar"])
+        for count in range(1, 4):
+            subscription.offer("foo", count)
+        subscription.offer("bar", 7)
+        assert subscription.wait(0) == {"foo": 3, "bar": 7}
+        assert subscription.wait(0) == {}
+
+    def test_wait_wakes_on_offer(self) -> None:
+        """Test ``wait`` returns as soon as a count is offered from another thread."""
+        subscription = Subscription(["foo"])
+        timer = threading.Timer(0.05, subscription.offer, args=("foo", 1))
+        timer.start()
+        assert subscription.wait(10) == {"foo": 1}
+        timer.join()
+
+    def test_close_wakes_waiting_reader(self) -> None:
+        """Test closing a subscription wakes ``wait``, which then never blocks."""
+        subscription = Subscription(["foo"])
+        timer = threading.Timer(0.05, subscription.close)
+        timer.start()
+        assert subscription.wait(10) == {}
+        timer.join()
+        assert subscription.closed
+        assert subscription.wait(10) == {}
+
+
+class TestBroker:
+    def test_publish_only_reaches_subscribers_of_key(self) -> None:
+        """Test counts are only offered to subscriptions for that key."""
+        broker = Broker()
+        foo, foo_bar = broker.subscribe(["foo"]), broker.subscribe(["foo", "bar"])
+        broker.publish("foo", 1)
+        broker.publish("bar", 2)
+        broker.publish("baz", 3)
+        assert foo.wait(0) == {"foo": 1}
+        assert foo_bar.wait(0) == {"foo": 1, "bar": 2}
+
+    def test_unsubscribe_removes_keys(self) -> None:
+        """Test unsubscribing stops updates, and drops keys with no subscribers."""
+        broker = Broker()
+        foo, foo_bar = broker.subscribe(["foo"]), broker.subscribe(["foo", "bar"])
+        assert len(broker) == 2
+
+        broker.unsubscribe(foo_bar)
+        broker.publish("foo", 1)
+        assert len(broker) == 1
+        assert foo_bar.wait(0) == {}
+
+        broker.unsubscribe(foo)
+        assert len(broker) == 0
+
+    def test_close_closes_current_and_future_subscriptions(self) -> None:
+        """Test closing the broker closes every subscription, including new ones."""
+        broker = Broker()
+        foo, foo_bar = broker.subscribe(["foo"]), broker.subscribe(["foo", "bar"])
+        broker.close()
+        assert foo.closed and foo_bar.closed
+        assert broker.subscribe(["bar"]).closed
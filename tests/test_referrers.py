@@ -0,0 +1,121 @@
+from typing import Optional
+
+import pytest
+
+from referrers import (
+    CountMinSketch,
+    ReferrerSketch,
+    ReferrerTracker,
+    normalise_referrer,
+)
+
+
+@pytest.mark.parametrize(
+    "test_input, test_expected",
+    [
+        ("https://github.com/octocat/Spoon-Knife", "github.com"),
+        ("https://WWW.Example.COM.:8080/foo?bar=baz", "example.com"),
+        ("http://127.0.0.1/", "127.0.0.1"),
+        ("not a url", None),
+        ("", None),
+        (None, None),
+    ],
+)
+def test_normalise_referrer_returns_correctly(
+    test_input: Optional[str], test_expected: Optional[str]
+) -> None:
+    """Test referrers are normalised to their lower case host, without ``www.``."""
+    assert normalise_referrer(test_input) == test_expected
+
+
+class TestCountMinSketch:
+    def test_estimates_are_exact_without_collisions(self) -> None:
+        """Test estimates equal the true counts when items do not collide."""
+        sketch = CountMinSketch(1024, 4)
+        for _ in range(5):
+            _ = sketch.add("foo")
+        assert sketch.add("bar", 3) == 3
+        assert (sketch.estimate("foo"), sketch.estimate("bar")) == (5, 3)
+        assert sketch.estimate("baz") == 0
+        assert sketch.total == 8
+
+    def test_estimates_never_too_low_and_error_is_bounded(self) -> None:
+        """Test estimates are never below the true count, and within the error bound."""
+        sketch = CountMinSketch(64, 4)
+        counts = {f"site{i}.example": i % 7 + 1 for i in range(2000)}
+        for host, count in counts.items():
+            _ = sketch.add(host, count)
+
+        # The overestimate is at most e / width of the total with high probability;
+        # check a generous multiple holds for nearly every host
+        bound = 2.72 / sketch.width * sketch.total
+        errors = [sketch.estimate(h) - c for h, c in counts.items()]
+        assert min(errors) >= 0
+        assert sum(e > bound for e in errors) < len(errors) * 0.05
+
+    def test_memory_is_fixed(self) -> None:
+        """Test the sketch size does not grow with the number of distinct items."""
+        sketch = CountMinSketch(64, 4)
+        size = len(sketch._cells)
+        for i in range(10000):
+            _ = sketch.add(str(i))
+        assert len(sketch._cells) == size == 64 * 4
+
+    @pytest.mark.parametrize("test_input_width, test_input_depth", [(0, 4), (64, 0)])
+    def test_invalid_dimensions_raise(
+        self, test_input_width: int, test_input_depth: int
+    ) -> None:
+        """Test a ``ValueError`` is raised for non-positive dimensions."""
+        with pytest.raises(ValueError, match="must be positive"):
+            _ = CountMinSketch(test_input_width, test_input_depth)
+
+
+class TestReferrerSketch:
+    def test_top_keeps_heaviest_referrers(self) -> None:
+        """Test only the ``top_k`` referrers with the highest counts are kept."""
+        sketch = ReferrerSketch(1024, 4, top_k=2)
+        for host, count in [("a.com", 5), ("b.com", 1), ("c.com", 3), ("d.com", 2)]:
+            for _ in range(count):
+                _ = sketch.add(host)
+        assert sketch.top() == [("a.com", 5), ("c.com", 3)]
+
+    def test_top_is_bounded_with_many_referrers(self) -> None:
+        """Test the top list never grows beyond ``top_k`` entries."""
+        sketch = ReferrerSketch(64, 4, top_k=3)
+        for i in range(1000):
+            _ = sketch.add(f"site{i}.example")
+        assert len(sketch.top()) == 3
+
+
+class TestReferrerTracker:
+    def test_counts_are_kept_per_page(self) -> None:
+        """Test referrers are counted separately for each page."""
+        tracker = ReferrerTracker(1024, 4, 10)
+        _ = tracker.add("page_a", "a.com")
+        _ = tracker.add("page_a", "a.com")
+        _ = tracker.add("page_b", "b.com")
+        assert tracker.get("page_a") == (2, [("a.com", 2)])
+        assert tracker.get("page_b", ["a.com", "b.com"]) == (
+            1,
+            [("a.com", 0), ("b.com", 1)],
+        )
+
+    def test_evicts_least_recently_visited_page_when_full(self) -> None:
+        """Test the number of pages is capped, evicting the coldest page first."""
+        tracker = ReferrerTracker(64, 2, 10, max_pages=2)
+        _ = tracker.add("page_a", "a.com")
+        _ = tracker.add("page_b", "b.com")
+        _ = tracker.add("page_a", "a.com")
+        for i in range(100):
+            _ = tracker.add(f"page_{i}", "c.com")
+            _ = tracker.add("page_a", "a.com")
+        assert len(tracker) == 2
+        assert tracker.get("page_a") == (102, [("a.com", 102)])
+        assert tracker.get("page_b") == (0, [])
+        assert tracker.get("page_99") == (1, [("c.com", 1)])
+
+    def test_unknown_page_returns_zero(self) -> None:
+        """Test an unknown page has no referred visits."""
+        tracker = ReferrerTracker(1024, 4, 10)
+        assert tracker.get("foo") == (0, [])
+        assert tracker.get("foo", ["a.com"]) == (0, [("a.com", 0)])
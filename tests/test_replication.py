@@ -0,0 +1,220 @@
+from pathlib import Path
+from typing import Callable, List
+from unittest.mock import MagicMock
+
+import pytest
+import requests
+
+from counters import LogBackend
+from main import get_page_hash
+from replication import GCounterBackend, Gossiper, get_replica_store
+from sharding import CLUSTER_SECRET_HEADER
+
+# Define the nodes used across the tests
+NODES = ["http://node-a", "http://node-b", "http://node-c"]
+
+# Define a page hash key, as durable stores only accept page hashes
+KEY = get_page_hash("foo")[:64]
+
+
+class TestGCounterBackend:
+    def test_hit_increments_own_slot(self) -> None:
+        """Test ``hit`` only increments this replica's slot."""
+        backend = GCounterBackend(NODES[0], NODES)
+        assert [backend.hit("foo") for _ in range(3)] == [1, 2, 3]
+        assert backend.state() == {"foo": {backend.replica: 3}}
+        assert backend.peers == NODES[1:]
+
+    def test_add_rejects_negative_deltas(self) -> None:
+        """Test ``add`` raises a ``ValueError`` for a negative delta."""
+        with pytest.raises(ValueError, match="cannot be decremented"):
+            _ = GCounterBackend(NODES[0], NODES).add("foo", -1)
+
+    def test_merge_converges_in_any_order(self) -> None:
+        """Test replicas merging each other's state, in any order, converge."""
+        replicas = [GCounterBackend(n, NODES) for n in NODES]
+        for i, replica in enumerate(replicas):
+            for _ in range(i + 1):
+                _ = replica.hit("foo")
+            _ = replica.hit(f"bar_{i}")
+
+        # Merge in opposite orders, including duplicate merges
+        for replica in replicas:
+            for other in replicas[::-1] + replicas:
+                _ = replica.merge(other.state())
+
+        assert all(r.state() == replicas[0].state() for r in replicas)
+        assert all(r.get("foo") == 6 for r in replicas)
+        assert sorted(replicas[0].items()) == [
+            ("bar_0", 1),
+            ("bar_1", 1),
+            ("bar_2", 1),
+            ("foo", 6),
+        ]
+
+    def test_durable_slot_survives_restart(self, tmp_path: Path) -> None:
+        """Test a durable store restores this node's slot, and resends it to peers."""
+        backend = GCounterBackend(NODES[0], NODES, LogBackend(str(tmp_path)))
+        _ = backend.merge({KEY: {NODES[1]: 5}})
+        assert [backend.hit(KEY) for _ in range(3)] == [6, 7, 8]
+        backend.close()
+
+        backend = GCounterBackend(NODES[0], NODES, LogBackend(str(tmp_path)))
+        assert backend.durable
+        assert backend.state() == {KEY: {NODES[0]: 3}}
+        assert backend.take_delta(NODES[1], 10) == {KEY: {NODES[0]: 3}}
+        assert backend.hit(KEY) == 4
+        backend.close()
+
+    def test_get_replica_store(self, tmp_path: Path) -> None:
+        """Test the replica store is held in memory, or a visit log."""
+        assert get_replica_store("memory", str(tmp_path)) is None
+        store = get_replica_store("log", str(tmp_path))
+        assert isinstance(store, LogBackend)
+        store.close()
+
+    def test_get_replica_store_rejects_shared_backends(self, tmp_path: Path) -> None:
+        """Test shared backends, like CountAPI, cannot hold a replica's slot."""
+        with pytest.raises(ValueError, match="memory, or log counter backend"):
+            _ = get_replica_store("countapi", str(tmp_path))
+
+    def test_merge_ignores_stale_counts(self) -> None:
+        """Test ``merge`` keeps the higher count for each slot."""
+        backend = GCounterBackend(NODES[0], NODES)
+        assert backend.merge({"foo": {"other": 5}}) == {"foo": 5}
+        assert backend.merge({"foo": {"other": 3}}) == {}
+        assert backend.get("foo") == 5
+
+    def test_deltas_only_include_changed_keys(self) -> None:
+        """Test deltas contain changed keys, and are not echoed back to the source."""
+        backend = GCounterBackend(NODES[0], NODES)
+        _ = backend.hit("foo")
+        _ = backend.merge({"bar": {"other": 2}}, source=NODES[1])
+
+        assert backend.take_delta(NODES[1], 10) == {"foo": {backend.replica: 1}}
+        assert backend.take_delta(NODES[1], 10) == {}
+        assert backend.take_delta(NODES[2], 10) == {
+            "foo": {backend.replica: 1},
+            "bar": {"other": 2},
+        }
+
+    def test_restore_delta_marks_keys_dirty_again(self) -> None:
+        """Test an unsent delta is sent again in a later round."""
+        backend = GCounterBackend(NODES[0], NODES)
+        _ = backend.hit("foo")
+        delta = backend.take_delta(NODES[1], 10)
+        backend.restore_delta(NODES[1], delta)
+        assert backend.take_delta(NODES[1], 10) == delta
+
+
+class TestGossiper:
+    def test_flush_sends_deltas_in_batches(self) -> None:
+        """Test ``flush`` sends all pending deltas to each peer in batches."""
+        backend, session = GCounterBackend(NODES[0], NODES), MagicMock()
+        for i in range(5):
+            _ = backend.hit(f"key_{i}")
+
+        gossiper = Gossiper(backend, NODES[0], session, "secret", 0, batch_size=2)
+        assert gossiper.flush() == {NODES[1]: 5, NODES[2]: 5}
+        assert session.post.call_count == 6
+        for peer in NODES[1:]:
+            calls = [
+                c for c in session.post.call_args_list if c.args[0].startswith(peer)
+            ]
+            assert {k for c in calls for k in c.kwargs["json"]["counts"]} == {
+                f"key_{i}" for i in range(5)
+            }
+            assert all(c.kwargs["json"]["source"] == NODES[0] for c in calls)
+            assert all(
+                c.kwargs["headers"] == {CLUSTER_SECRET_HEADER: "secret"} for c in calls
+            )
+        assert gossiper.flush() == {NODES[1]: 0, NODES[2]: 0}
+
+    def test_flush_retries_failed_deltas(self) -> None:
+        """Test deltas that fail to send are sent in the next round."""
+        backend, session = GCounterBackend(NODES[0], NODES), MagicMock()
+        session.post.side_effect = [
+            requests.ConnectionError(),
+            MagicMock(),
+            MagicMock(),
+        ]
+        _ = backend.hit("foo")
+
+        gossiper = Gossiper(backend, NODES[0], session, "secret", 0)
+        assert gossiper.flush() == {NODES[1]: 0, NODES[2]: 1}
+        assert gossiper.flush() == {NODES[1]: 1, NODES[2]: 0}
+
+    def test_pull_merges_peer_state(self) -> None:
+        """Test ``pull`` merges the full state of reachable peers."""
+        backend, session = GCounterBackend(NODES[0], NODES), MagicMock()
+        session.get.return_value.json.return_value = {"counts": {"foo": {"x": 2}}}
+        session.get.side_effect = [requests.ConnectionError(), session.get.return_value]
+
+        assert Gossiper(backend, NODES[0], session, "secret", 0).pull() == [NODES[1]]
+        assert backend.get("foo") == 2
+
+
+class TestGossiperStart:
+    def test_restores_stable_slot_from_peers(self) -> None:
+        """Test a restarted node restores its own slot from peers, and keeps using it."""
+        backend, session = GCounterBackend(NODES[0], NODES), MagicMock()
+        session.get.return_value.json.return_value = {"counts": {"foo": {NODES[0]: 4}}}
+
+        Gossiper(backend, NODES[0], session, "secret", 0).start()
+        assert backend.replica == NODES[0]
+        assert backend.hit("foo") == 5
+        assert backend.state() == {"foo": {NODES[0]: 5}}
+
+    def test_uses_temporary_slot_if_peers_unreachable(self) -> None:
+        """Test a node counts in a temporary slot if its slot can't be restored."""
+        backend, session = GCounterBackend(NODES[0], NODES), MagicMock()
+        session.get.return_value.json.return_value = {"counts": {"foo": {NODES[0]: 4}}}
+        session.get.side_effect = [requests.ConnectionError(), session.get.return_value]
+
+        Gossiper(backend, NODES[0], session, "secret", 0).start()
+        assert backend.replica.startswith(f"{NODES[0]}@")
+        assert backend.hit("foo") == 5
+        assert backend.state()["foo"][NODES[0]] == 4
+
+    def test_keeps_durable_slot_if_peers_unreachable(self, tmp_path: Path) -> None:
+        """Test a node with a durable slot keeps it, even if no peer is up yet."""
+        backend = GCounterBackend(NODES[0], NODES, LogBackend(str(tmp_path)))
+        session = MagicMock()
+        session.get.side_effect = requests.ConnectionError()
+
+        Gossiper(backend, NODES[0], session, "secret", 0).start()
+        assert backend.replica == NODES[0]
+        assert backend.hit(KEY) == 1
+        assert backend.state() == {KEY: {NODES[0]: 1}}
+        backend.close()
+
+
+def test_replicated_cluster_converges(
+    start_app_nodes: Callable[..., List[str]],
+    stub_shields_io: str,
+) -> None:
+    """Test several local replicas accept hits independently, and converge."""
+    urls = start_app_nodes(
+        3,
+        COUNTER_BACKEND="memory",
+        CLUSTER_MODE="replicated",
+        CLUSTER_SECRET="pytest",
+        GOSSIP_INTERVAL="0",
+        URL_SHIELDS_IO=stub_shields_io,
+    )
+    session = requests.Session()
+    headers = {CLUSTER_SECRET_HEADER: "pytest"}
+
+    # Visit the page a different number of times through each node
+    for i, url in enumerate(urls):
+        for _ in range(i + 1):
+            response = session.get(f"{url}/badge", params={"page": "foo"}, timeout=10)
+            assert response.status_code == 200
+
+    # Run one gossip round on each node, then assert every node has the merged sum
+    for url in urls:
+        _ = session.post(f"{url}/internal/gossip/flush", headers=headers, timeout=10)
+    key = get_page_hash("foo")[:64]
+    for url in urls:
+        response = session.get(f"{url}/internal/count/{key}", headers=headers)
+        assert response.json() == {"value": 6}
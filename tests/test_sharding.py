@@ -0,0 +1,204 @@
+from collections import Counter
+from typing import Callable, List
+from unittest.mock import MagicMock
+
+import requests
+
+from counters import MemoryBackend
+from main import get_page_hash
+from sharding import CLUSTER_SECRET_HEADER, ClusterBackend, HashRing, rebalance
+
+# Define page hash keys used across the tests
+KEYS = [get_page_hash(f"page_{i}")[:64] for i in range(2000)]
+NODES = ["http://node-a", "http://node-b", "http://node-c"]
+
+
+class TestHashRing:
+    def test_get_node_returns_none_for_empty_ring(self) -> None:
+        """Test ``get_node`` returns None if there are no nodes."""
+        assert HashRing().get_node(KEYS[0]) is None
+
+    def test_get_node_is_deterministic(self) -> None:
+        """Test rings built from the same nodes, in any order, agree on owners."""
+        ring, reversed_ring = HashRing(NODES), HashRing(reversed(NODES))
+        assert [ring.get_node(k) for k in KEYS] == [
+            reversed_ring.get_node(k) for k in KEYS
+        ]
+
+    def test_keys_spread_across_nodes(self) -> None:
+        """Test keys are spread roughly evenly between nodes."""
+        owners = Counter(HashRing(NODES).get_node(k) for k in KEYS)
+        assert set(owners) == set(NODES)
+        assert min(owners.values()) > len(KEYS) / len(NODES) * 0.6
+
+    def test_adding_node_only_moves_keys_to_new_node(self) -> None:
+        """Test adding a node only moves keys onto the new node."""
+        ring = HashRing(NODES)
+        before = {k: ring.get_node(k) for k in KEYS}
+        ring.add_node("http://node-d")
+        moved = [k for k in KEYS if ring.get_node(k) != before[k]]
+        assert {ring.get_node(k) for k in moved} == {"http://node-d"}
+        assert len(moved) < len(KEYS) / 2
+
+    def test_removing_node_only_moves_its_keys(self) -> None:
+        """Test removing a node only moves keys that it owned."""
+        ring = HashRing(NODES)
+        before = {k: ring.get_node(k) for k in KEYS}
+        ring.remove_node("http://node-b")
+        assert ring.nodes == ["http://node-a", "http://node-c"]
+        for key in KEYS:
+            if before[key] != "http://node-b":
+                assert ring.get_node(key) == before[key]
+
+
+class TestRebalance:
+    def test_hands_off_keys_owned_by_other_nodes(self) -> None:
+        """Test counts for keys owned by other nodes are sent, then removed."""
+        backend, session = MemoryBackend(), MagicMock()
+        session.request.return_value.status_code = 200
+        for key in KEYS[:100]:
+            _ = backend.add(key, 3)
+
+        ring = HashRing(NODES)
+        moved, failed = rebalance(ring, NODES[0], backend, session, "secret")
+
+        # Assert only keys owned by this node remain, and the rest were sent
+        assert failed == []
+        assert {ring.get_node(k) for k, _ in backend.items()} == {NODES[0]}
+        assert moved == 100 - len(list(backend.items()))
+        sent = {
+            k: v
+            for c in session.request.call_args_list
+            for k, v in c.kwargs["json"].items()
+        }
+        assert sent == {k: 3 for k in KEYS[:100] if ring.get_node(k) != NODES[0]}
+        assert all(
+            c.kwargs["headers"] == {CLUSTER_SECRET_HEADER: "secret"}
+            for c in session.request.call_args_list
+        )
+
+    def test_keeps_counts_if_hand_off_fails(self) -> None:
+        """Test counts are kept locally if the new owner rejects them."""
+        backend, session = MemoryBackend(), MagicMock()
+        session.request.side_effect = requests.ConnectionError()
+        for key in KEYS[:100]:
+            _ = backend.add(key, 1)
+
+        moved, failed = rebalance(HashRing(NODES), NODES[0], backend, session, "s")
+        assert moved == 0
+        assert sorted(failed) == NODES[1:]
+        assert len(list(backend.items())) == 100
+
+
+class TestClusterBackend:
+    def test_get_returns_none_for_missing_counts(self) -> None:
+        """Test ``get`` returns None if the owner has no count for the key."""
+        session = MagicMock()
+        session.get.return_value.status_code = 404
+        assert ClusterBackend(NODES, "s", session).get(KEYS[0]) is None
+        session.get.return_value.raise_for_status.assert_not_called()
+
+
+def test_cluster_routes_pages_to_owner_nodes(
+    start_app_nodes: Callable[..., List[str]],
+    stub_shields_io: str,
+) -> None:
+    """Test several local nodes agree on counts, whichever node is visited."""
+    urls = start_app_nodes(
+        3,
+        COUNTER_BACKEND="memory",
+        CLUSTER_SECRET="pytest",
+        URL_SHIELDS_IO=stub_shields_io,
+    )
+    session = requests.Session()
+
+    # Visit each page once through each node
+    for page in ["foo", "bar", "baz", "qux"]:
+        for url in urls:
+            response = session.get(
+                f"{url}/badge",
+                params={"page": page, "style": "flat"},
+                timeout=10,
+            )
+            assert response.status_code == 200
+
+    # Hit each page once more directly on its owner, and assert it holds all visits
+    ring = HashRing(urls)
+    for page in ["foo", "bar", "baz", "qux"]:
+        key = get_page_hash(page)[:64]
+        response = session.post(
+            f"{ring.get_node(key)}/internal/count/{key}",
+            headers={CLUSTER_SECRET_HEADER: "pytest"},
+            timeout=10,
+        )
+        assert response.json() == {"value": 4}
+
+
+def test_cluster_rebalances_when_node_leaves(
+    start_app_nodes: Callable[..., List[str]],
+    stub_shields_io: str,
+) -> None:
+    """Test counts are handed off to the remaining nodes when a node leaves."""
+    urls = start_app_nodes(
+        3,
+        COUNTER_BACKEND="memory",
+        CLUSTER_SECRET="pytest",
+        URL_SHIELDS_IO=stub_shields_io,
+    )
+    session = requests.Session()
+    headers = {CLUSTER_SECRET_HEADER: "pytest"}
+
+    # Visit pages owned by the leaving node through another node
+    ring = HashRing(urls)
+    pages = [f"page_{i}" for i, k in enumerate(KEYS) if ring.get_node(k) == urls[0]]
+    for page in pages[:20]:
+        _ = session.get(f"{urls[1]}/badge", params={"page": page}, timeout=10)
+
+    # Remove the first node from every node's ring; the leaving node hands off last
+    for url in reversed(urls):
+        response = session.put(
+            f"{url}/internal/nodes", json={"nodes": urls[1:]}, headers=headers
+        )
+        assert response.status_code == 200
+    assert response.json() == {"nodes": urls[1:], "moved": 20, "failed": []}
+
+    # Assert the new owners continue counting from the handed off counts
+    ring = HashRing(urls[1:])
+    for page in pages[:20]:
+        key = get_page_hash(page)[:64]
+        response = session.post(
+            f"{ring.get_node(key)}/internal/count/{key}", headers=headers
+        )
+        assert response.json() == {"value": 2}
+
+
+def test_cluster_streams_visits_counted_on_owner_nodes(
+    start_app_nodes: Callable[..., List[str]],
+    stub_shields_io: str,
+) -> None:
+    """Test a live count stream follows visits counted on the node owning the page."""
+    urls = start_app_nodes(
+        2,
+        COUNTER_BACKEND="memory",
+        CLUSTER_SECRET="pytest",
+        STREAM_HEARTBEAT="1",
+        STREAM_MAX_PAGES="20",
+        URL_SHIELDS_IO=stub_shields_io,
+    )
+    session = requests.Session()
+
+    # Stream a page owned by the second node from the first node
+    ring = HashRing(urls)
+    page = next(f"page_{i}" for i, k in enumerate(KEYS) if ring.get_node(k) == urls[1])
+    with session.get(
+        f"{urls[0]}/stream", params={"page": page}, stream=True, timeout=10
+    ) as stream:
+        events = (e for e in stream.iter_lines(delimiter=b"\n\n") if e)
+        assert next(events) == f'event: count\ndata: {{"{page}": 0}}'.encode()
+
+        # Visit the page directly on its owner, and assert the stream is sent the count
+        response = session.get(f"{urls[1]}/badge", params={"page": page}, timeout=10)
+        assert response.status_code == 200
+        assert next(e for e in events if not e.startswith(b":")) == (
+            f'event: count\ndata: {{"{page}": 1}}'.encode()
+        )
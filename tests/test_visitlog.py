@@ -0,0 +1,308 @@
+import os
+import signal
+import subprocess  # noqa: S404
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+from pytest_mock import MockerFixture
+
+from visitlog import RECORD_SIZE, VisitLog, encode_key
+
+# Root directory of the repository, where the visit log module is imported from
+ROOT_DIRECTORY = Path(__file__).resolve().parents[1]
+
+# Page hash keys for testing
+KEYS = [f"{i:064x}" for i in range(4)]
+
+# Script that hits every key from its own thread until killed, printing each
+# acknowledged count
+CRASH_SCRIPT = """
+import sys, threading
+from visitlog import VisitLog
+log = VisitLog(sys.argv[1], segment_bytes=int(sys.argv[2]))
+lock = threading.Lock()
+def run(key):
+    while True:
+        count = log.add(key, 1)
+        with lock:
+            print(key, count, flush=True)
+for key in sys.argv[3:]:
+    threading.Thread(target=run, args=(key,)).start()
+"""
+
+# Script that writes to a log, holds it open for a moment, then closes it, like an old
+# worker gracefully shutting down
+HOLD_SCRIPT = """
+import sys, time
+from visitlog import VisitLog
+log = VisitLog(sys.argv[1])
+log.add(sys.argv[2], 1)
+print("open", flush=True)
+time.sleep(0.5)
+log.close()
+"""
+
+# Script that writes to a log in a gevent worker, with each sync slowed down, and
+# prints how often another greenlet ran while it waited for the write
+GEVENT_SCRIPT = """
+from gevent import monkey
+monkey.patch_all()
+import os, sys
+import gevent
+from visitlog import VisitLog
+sleep, fsync = monkey.get_original("time", "sleep"), os.fsync
+def slow_fsync(fd):
+    sleep(0.2)
+    fsync(fd)
+os.fsync = slow_fsync
+log = VisitLog(sys.argv[1])
+ticks = []
+def tick():
+    while True:
+        gevent.sleep(0.01)
+        ticks.append(1)
+ticker = gevent.spawn(tick)
+gevent.sleep(0)
+log.add(sys.argv[2], 1)
+print(len(ticks))
+"""
+
+
+def get_segments(directory: Path) -> List[Path]:
+    """Get the segment files in a log directory, in order."""
+    return sorted(directory.glob("*.log"))
+
+
+@pytest.mark.parametrize("test_input", ["foo", "AB" * 32, "zz" * 32, "ab" * 33])
+def test_encode_key_raises_for_non_page_hashes(test_input: str) -> None:
+    """Test ``encode_key`` raises a ``ValueError`` unless given 64 hex characters."""
+    with pytest.raises(ValueError, match="64 hexadecimal characters"):
+        _ = encode_key(test_input)
+
+
+class TestVisitLog:
+    def test_counts_survive_reopening(self, tmp_path: Path) -> None:
+        """Test counts are the same after closing, and reopening the log."""
+        log = VisitLog(str(tmp_path))
+        assert [log.add(KEYS[0], 1) for _ in range(3)] == [1, 2, 3]
+        assert log.add(KEYS[1], 5) == 5
+        log.set_many({KEYS[1]: 2, KEYS[2]: 7})
+        assert log.add(KEYS[2], -7) == 0
+        log.close()
+
+        log = VisitLog(str(tmp_path))
+        assert sorted(log.items()) == [(KEYS[0], 3), (KEYS[1], 2)]
+        assert log.get(KEYS[2]) == 0
+        log.close()
+
+    def test_records_are_fixed_size(self, tmp_path: Path) -> None:
+        """Test each change appends exactly one fixed-size record."""
+        log = VisitLog(str(tmp_path))
+        for key in KEYS:
+            _ = log.add(key, 1)
+        log.close()
+        assert [p.stat().st_size for p in get_segments(tmp_path)] == [4 * RECORD_SIZE]
+
+    def test_concurrent_writers_share_syncs(
+        self, mocker: MockerFixture, tmp_path: Path
+    ) -> None:
+        """Test concurrent writers are committed in groups, not one sync each."""
+        log = VisitLog(str(tmp_path), commit_delay=0.1)
+        spy_fsync = mocker.spy(os, "fsync")
+        barrier = threading.Barrier(16)
+
+        def hit(key: str) -> None:
+            _ = barrier.wait()
+            _ = log.add(key, 1)
+
+        threads = [threading.Thread(target=hit, args=(KEYS[i % 4],)) for i in range(16)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Assert every write is durable, using far fewer syncs than writes
+        assert spy_fsync.call_count <= 4
+        assert sorted(log.items()) == [(k, 4) for k in KEYS]
+        log.close()
+
+    def test_full_segments_are_compacted(self, tmp_path: Path) -> None:
+        """Test full segments are folded into the snapshot, and removed."""
+        log = VisitLog(str(tmp_path), segment_bytes=10 * RECORD_SIZE)
+        for i in range(100):
+            _ = log.add(KEYS[i % 4], 1)
+        _ = log.compact()
+
+        # Assert only the current segment remains, alongside the snapshot
+        assert len(get_segments(tmp_path)) == 1
+        assert (tmp_path / "snapshot.idx").exists()
+        log.close()
+
+        log = VisitLog(str(tmp_path), segment_bytes=10 * RECORD_SIZE)
+        assert sorted(log.items()) == [(k, 25) for k in KEYS]
+        log.close()
+
+    def test_items_are_in_key_order(self, tmp_path: Path) -> None:
+        """Test items are listed in key order, before, and after compaction."""
+        log = VisitLog(str(tmp_path), segment_bytes=10 * RECORD_SIZE)
+        for i in range(100):
+            _ = log.add(KEYS[-1 - i % 4], 1)
+        assert [k for k, _ in log.items()] == KEYS
+        _ = log.compact()
+        assert [k for k, _ in log.items()] == KEYS
+        log.close()
+
+    @pytest.mark.parametrize(
+        "test_input", [b"\x01" * (RECORD_SIZE // 2), b"\x01" * (RECORD_SIZE * 2)]
+    )
+    def test_torn_records_are_truncated(
+        self, tmp_path: Path, test_input: bytes
+    ) -> None:
+        """Test a torn, or corrupt, record at the end of a segment is discarded."""
+        log = VisitLog(str(tmp_path))
+        for _ in range(3):
+            _ = log.add(KEYS[0], 1)
+        log.close()
+        segment = get_segments(tmp_path)[-1]
+        with segment.open("ab") as f:
+            _ = f.write(test_input)
+
+        log = VisitLog(str(tmp_path))
+        assert log.get(KEYS[0]) == 3
+        assert segment.stat().st_size == 3 * RECORD_SIZE
+        assert log.add(KEYS[0], 1) == 4
+        log.close()
+
+    def test_folded_segments_are_not_replayed_twice(self, tmp_path: Path) -> None:
+        """Test segments already in the snapshot are removed, not replayed, on opening.
+
+        This is the state left by a crash after writing the snapshot, but before
+        removing the segments folded into it.
+
+        """
+        log = VisitLog(str(tmp_path), segment_bytes=10 * RECORD_SIZE)
+        for _ in range(30):
+            _ = log.add(KEYS[0], 1)
+        log.close()
+        copies = {p.name: p.read_bytes() for p in get_segments(tmp_path)}
+
+        # Compact, and put back the folded segments
+        log = VisitLog(str(tmp_path), segment_bytes=10 * RECORD_SIZE)
+        _ = log.compact()
+        log.close()
+        for name, data in copies.items():
+            _ = (tmp_path / name).write_bytes(data)
+
+        log = VisitLog(str(tmp_path), segment_bytes=10 * RECORD_SIZE)
+        assert log.get(KEYS[0]) == 30
+        assert not set(copies) & {p.name for p in get_segments(tmp_path)}
+        log.close()
+
+    def test_directory_can_only_be_opened_once(self, tmp_path: Path) -> None:
+        """Test a second log cannot open a directory that is already open."""
+        log = VisitLog(str(tmp_path))
+        with pytest.raises(BlockingIOError):
+            _ = VisitLog(str(tmp_path), lock_timeout=0.1)
+        log.close()
+        VisitLog(str(tmp_path)).close()
+
+    def test_waits_for_directory_to_be_closed(self, tmp_path: Path) -> None:
+        """Test opening a log waits for another process to close it, as on reload."""
+        process = subprocess.Popen(  # noqa: S603
+            [sys.executable, "-c", HOLD_SCRIPT, str(tmp_path), KEYS[0]],
+            cwd=ROOT_DIRECTORY,
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        assert process.stdout is not None
+        assert process.stdout.readline().strip() == "open"
+
+        # Assert the log opens once the other process closes it, with its counts
+        log = VisitLog(str(tmp_path), lock_timeout=10)
+        assert log.get(KEYS[0]) == 1
+        assert process.wait() == 0
+        log.close()
+
+    def test_corrupt_snapshot_raises(self, tmp_path: Path) -> None:
+        """Test a ``ValueError`` is raised if the snapshot is corrupt."""
+        log = VisitLog(str(tmp_path), segment_bytes=RECORD_SIZE)
+        _ = log.add(KEYS[0], 1)
+        _ = log.compact()
+        log.close()
+        snapshot = tmp_path / "snapshot.idx"
+        _ = snapshot.write_bytes(snapshot.read_bytes()[:-1] + b"\x00")
+        with pytest.raises(ValueError, match="Corrupt visit log snapshot"):
+            _ = VisitLog(str(tmp_path))
+
+    def test_closed_log_rejects_writes(self, tmp_path: Path) -> None:
+        """Test writing to a closed log raises a ``ValueError``."""
+        log = VisitLog(str(tmp_path))
+        log.close()
+        with pytest.raises(ValueError, match="closed"):
+            _ = log.add(KEYS[0], 1)
+
+
+def test_syncs_do_not_block_other_greenlets(tmp_path: Path) -> None:
+    """Test syncs run off the gevent event loop, so other requests keep running."""
+    output = subprocess.run(  # noqa: S603
+        [sys.executable, "-c", GEVENT_SCRIPT, str(tmp_path), KEYS[0]],
+        cwd=ROOT_DIRECTORY,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    assert int(output) >= 5
+
+
+@pytest.mark.parametrize("test_input_acks", [50, 500, 2000])
+def test_acknowledged_writes_survive_process_kill(
+    tmp_path: Path, test_input_acks: int
+) -> None:
+    """Test every acknowledged write survives the process being killed mid-write.
+
+    Small segments make the process start new segments, and compact, throughout,
+    so the kill can land during a commit, a new segment, or a compaction.
+
+    """
+    process = subprocess.Popen(  # noqa: S603
+        [
+            sys.executable,
+            "-c",
+            CRASH_SCRIPT,
+            str(tmp_path),
+            str(20 * RECORD_SIZE),
+            *KEYS,
+        ],
+        cwd=ROOT_DIRECTORY,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert process.stdout is not None
+
+    # Read acknowledgements until enough are seen, then kill the process
+    acknowledged: Dict[str, int] = {k: 0 for k in KEYS}
+    for _ in range(test_input_acks):
+        key, count = process.stdout.readline().split()
+        acknowledged[key] = max(acknowledged[key], int(count))
+    os.kill(process.pid, signal.SIGKILL)
+    for line in process.stdout:
+        key, _, count = line.partition(" ")
+        if count.strip().isdigit():
+            acknowledged[key] = max(acknowledged[key], int(count))
+    _ = process.wait()
+
+    # Assert every acknowledged write is recovered, with at most one unacknowledged
+    # write per key, that was in flight when the process was killed
+    log = VisitLog(str(tmp_path), segment_bytes=20 * RECORD_SIZE)
+    recovered = dict(log.items())
+    for key in KEYS:
+        assert acknowledged[key] <= recovered[key] <= acknowledged[key] + 1
+    log.close()
+
+    # Assert recovery leaves a log that reopens with the same counts
+    log = VisitLog(str(tmp_path), segment_bytes=20 * RECORD_SIZE)
+    assert dict(log.items()) == recovered
+    log.close()
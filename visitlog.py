@@ -0,0 +1,500 @@
+import fcntl
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Mapping, Optional, Tuple
+
+# Record layout: 32-byte page hash key, signed 64-bit delta, and unsigned 64-bit
+# timestamp in microseconds, followed by a CRC32 of those fields; all little-endian
+RECORD_BODY = struct.Struct("<32sqQ")
+RECORD_SIZE = RECORD_BODY.size + 4
+
+# Snapshot layout: a header of magic bytes, the first segment not folded into the
+# snapshot, and the number of entries, then 32-byte key, and signed 64-bit count
+# entries sorted by key, followed by a CRC32 of everything before it
+SNAPSHOT_MAGIC = b"VISITIDX"
+SNAPSHOT_HEADER = struct.Struct("<8sQQ")
+SNAPSHOT_ENTRY = struct.Struct("<32sq")
+
+# File names in the log directory
+LOCK_NAME = "lock"
+SNAPSHOT_NAME = "snapshot.idx"
+SEGMENT_SUFFIX = ".log"
+
+# Default maximum size of a segment before a new one is started
+DEFAULT_SEGMENT_BYTES = 4 * 1024 * 1024
+
+# Default seconds to wait for another process to release the log directory, kept
+# below gunicorn's 30 second worker timeout, so a new worker that cannot lock it
+# fails with an error, rather than being killed, and seconds between attempts to
+# lock it
+DEFAULT_LOCK_TIMEOUT = 20.0
+LOCK_POLL_INTERVAL = 0.05
+
+
+def encode_key(key: str) -> bytes:
+    """Encode a page hash key as the 32 raw bytes it is the hexadecimal form of.
+
+    Args:
+        key (str): A page hash key of 64 lower case hexadecimal characters, such as
+            the first 64 characters of ``get_page_hash``.
+
+    Returns:
+        The key as 32 bytes.
+
+    Raises:
+        ValueError: If the key is not 64 lower case hexadecimal characters.
+
+    Examples:
+        >>> encode_key("ab" * 32).hex() == "ab" * 32
+        True
+
+    """
+    try:
+        raw = bytes.fromhex(key)
+    except ValueError:
+        raw = b""
+    if len(raw) != 32 or raw.hex() != key:
+        raise ValueError(f"Visit log keys must be 64 hexadecimal characters: {key!r}")
+    return raw
+
+
+def pack_record(key: bytes, delta: int, timestamp: int) -> bytes:
+    """Pack a record as fixed-size bytes, with a trailing checksum.
+
+    Args:
+        key (bytes): A 32-byte encoded key.
+        delta (int): The change to the count.
+        timestamp (int): Microseconds since the epoch.
+
+    Returns:
+        ``RECORD_SIZE`` bytes.
+
+    """
+    body = RECORD_BODY.pack(key, delta, timestamp)
+    return body + struct.pack("<I", zlib.crc32(body))
+
+
+def replay_records(data: bytes, counts: Dict[bytes, int]) -> int:
+    """Apply the deltas of packed records to some counts, stopping at a bad record.
+
+    Args:
+        data (bytes): Packed records, as read from a segment.
+        counts (Dict[bytes, int]): Encoded keys mapped to counts, updated in place;
+            keys whose count reaches zero are removed.
+
+    Returns:
+        The length of the valid records; anything after it is a torn, or corrupt,
+        record, and all that follows it.
+
+    """
+    offset = 0
+    while offset + RECORD_SIZE <= len(data):
+        body = data[offset : offset + RECORD_BODY.size]
+        (checksum,) = struct.unpack_from("<I", data, offset + RECORD_BODY.size)
+        if zlib.crc32(body) != checksum:
+            break
+        key, delta, _ = RECORD_BODY.unpack(body)
+        count = counts.get(key, 0) + delta
+        if count:
+            counts[key] = count
+        else:
+            _ = counts.pop(key, None)
+        offset += RECORD_SIZE
+    return offset
+
+
+def lock_exclusive(lock_file: BinaryIO, timeout: float) -> None:
+    """Take an exclusive lock on a file, waiting for up to ``timeout`` seconds.
+
+    Args:
+        lock_file (BinaryIO): The open file to lock.
+        timeout (float): Seconds to wait for another process to release the lock.
+
+    Raises:
+        BlockingIOError: If the lock is still held by another process after
+            ``timeout`` seconds.
+
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                raise
+            time.sleep(LOCK_POLL_INTERVAL)
+
+
+def fsync(fd: int) -> None:
+    """Flush a file to disk, without blocking other greenlets if running in gevent.
+
+    Once gevent has patched ``threading``, the commit, and compactor threads are
+    greenlets sharing one OS thread, so a blocking ``os.fsync`` would stall every
+    request in the worker, including writers waiting to join the next group commit.
+    The sync is run in gevent's native thread pool instead.
+
+    Args:
+        fd (int): The file descriptor to flush.
+
+    """
+    monkey = sys.modules.get("gevent.monkey")
+    if monkey is not None and monkey.is_module_patched("threading"):
+        _ = sys.modules["gevent"].get_hub().threadpool.apply(os.fsync, (fd,))
+    else:
+        os.fsync(fd)
+
+
+def fsync_directory(path: str) -> None:
+    """Flush a directory's entries to disk, so created, renamed, and removed files
+    survive a crash."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class VisitLog:
+    """Durable page counts held in memory, backed by an append-only segment log.
+
+    Every change is appended to the current segment as a fixed-size record before
+    the call that made it returns. Concurrent writers share one ``fsync``: the first
+    to wait writes, and syncs, every buffered record while the others wait for it,
+    so each change waits for at most two syncs, plus ``commit_delay``. Counts are
+    updated in memory before they are durable, so reads may see changes that are
+    still being synced. In gevent workers, syncs run in gevent's thread pool; see
+    ``fsync``.
+
+    Once a segment reaches ``segment_bytes``, a new one is started, and a background
+    thread folds the full segments into a snapshot of all counts, and deletes them.
+    On opening, the snapshot is loaded, the remaining segments replayed, and any
+    torn record at the end of a segment, from a crash mid-write, is truncated.
+
+    Only one process can open a log directory at a time; another waits for up to
+    ``lock_timeout`` seconds for it to be closed, such as while gunicorn gracefully
+    replaces an old worker with a new one on reload.
+
+    Args:
+        directory (str): The log directory; created if it doesn't exist.
+        segment_bytes (int): Size a segment can reach before a new one is started.
+            Default: 4 MiB.
+        commit_delay (float): Seconds a commit waits for more writers to join it,
+            trading latency for fewer syncs. Default: 0.0.
+        lock_timeout (float): Seconds to wait for another process to close the log
+            directory. Default: 30.0.
+
+    Raises:
+        BlockingIOError: If another process still has the log directory open after
+            ``lock_timeout`` seconds.
+        ValueError: If the snapshot is corrupt.
+
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = DEFAULT_SEGMENT_BYTES,
+        commit_delay: float = 0.0,
+        lock_timeout: float = DEFAULT_LOCK_TIMEOUT,
+    ) -> None:
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.commit_delay = commit_delay
+        self._lock = threading.Lock()
+        self._committed = threading.Condition(self._lock)
+        self._compact_lock = threading.Lock()
+        self._compact_requested = threading.Event()
+        self._buffer = bytearray()
+        self._appended = 0
+        self._synced = 0
+        self._committing = False
+        self._closed = False
+        self._error: Optional[OSError] = None
+
+        # Lock the directory, so no other process writes to the same segments
+        os.makedirs(directory, exist_ok=True)
+        self._lock_file = open(os.path.join(directory, LOCK_NAME), "ab")
+        try:
+            lock_exclusive(self._lock_file, lock_timeout)
+            self._counts, self._segment_id = self._recover()
+        except Exception:
+            self._lock_file.close()
+            raise
+        self._file = self._open_segment(self._segment_id)
+
+        # Start compacting in the background, folding any segments left by recovery
+        self._compactor = threading.Thread(target=self._run_compactor, daemon=True)
+        self._compactor.start()
+        self._compact_requested.set()
+
+    def _path(self, name: str) -> str:
+        """Get the path of a file in the log directory."""
+        return os.path.join(self.directory, name)
+
+    def _segment_ids(self) -> List[int]:
+        """Get the IDs of all segments in the log directory, in order."""
+        return sorted(
+            int(n[: -len(SEGMENT_SUFFIX)])
+            for n in os.listdir(self.directory)
+            if n.endswith(SEGMENT_SUFFIX) and n[: -len(SEGMENT_SUFFIX)].isdigit()
+        )
+
+    def _segment_path(self, segment_id: int) -> str:
+        """Get the path of a segment."""
+        return self._path(f"{segment_id:016d}{SEGMENT_SUFFIX}")
+
+    def _open_segment(self, segment_id: int) -> BinaryIO:
+        """Open a segment for appending, making sure its directory entry is durable."""
+        segment = open(self._segment_path(segment_id), "ab")
+        fsync_directory(self.directory)
+        return segment
+
+    def _read_snapshot(self) -> Tuple[int, Dict[bytes, int]]:
+        """Read the snapshot, returning the first segment not folded into it, and its
+        counts."""
+        try:
+            with open(self._path(SNAPSHOT_NAME), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return 0, {}
+        if len(data) < SNAPSHOT_HEADER.size + 4:
+            raise ValueError(f"Corrupt visit log snapshot in {self.directory}")
+        body, (checksum,) = data[:-4], struct.unpack("<I", data[-4:])
+        if zlib.crc32(body) != checksum:
+            raise ValueError(f"Corrupt visit log snapshot in {self.directory}")
+        magic, watermark, size = SNAPSHOT_HEADER.unpack_from(body)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Corrupt visit log snapshot in {self.directory}")
+        entries = SNAPSHOT_ENTRY.iter_unpack(body[SNAPSHOT_HEADER.size :])
+        counts = dict(entries)
+        if len(counts) != size:
+            raise ValueError(f"Corrupt visit log snapshot in {self.directory}")
+        return watermark, counts
+
+    def _write_snapshot(self, watermark: int, counts: Mapping[bytes, int]) -> None:
+        """Atomically replace the snapshot."""
+        data = bytearray(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, watermark, len(counts)))
+        for key in sorted(counts):
+            data += SNAPSHOT_ENTRY.pack(key, counts[key])
+        data += struct.pack("<I", zlib.crc32(data))
+        path = self._path(SNAPSHOT_NAME)
+        with open(f"{path}.tmp", "wb") as f:
+            _ = f.write(data)
+            f.flush()
+            fsync(f.fileno())
+        os.replace(f"{path}.tmp", path)
+        fsync_directory(self.directory)
+
+    def _recover(self) -> Tuple[Dict[bytes, int], int]:
+        """Load the snapshot, and replay the segments after it.
+
+        Returns:
+            A tuple of the recovered counts, and the ID for a new segment.
+
+        """
+        watermark, counts = self._read_snapshot()
+        segment_ids = self._segment_ids()
+        for segment_id in segment_ids:
+            path = self._segment_path(segment_id)
+            if segment_id < watermark:
+                # Already folded into the snapshot before a crash stopped its removal
+                os.remove(path)
+                continue
+            with open(path, "rb+") as f:
+                data = f.read()
+                valid = replay_records(data, counts)
+                if valid < len(data):
+                    _ = f.truncate(valid)
+                    fsync(f.fileno())
+        fsync_directory(self.directory)
+        return counts, max([watermark - 1, *segment_ids]) + 1
+
+    def _run_compactor(self) -> None:
+        """Compact whenever requested, until closed."""
+        while True:
+            _ = self._compact_requested.wait()
+            self._compact_requested.clear()
+            if self._closed:
+                return
+            try:
+                _ = self.compact()
+            except OSError:
+                # Folded segments are only removed once the snapshot is durable, so
+                # a failed compaction loses nothing, and is retried after the next
+                # new segment, or when the log is next opened
+                pass
+
+    def compact(self) -> int:
+        """Fold all full segments into the snapshot, and delete them.
+
+        Returns:
+            The number of segments folded.
+
+        """
+        with self._compact_lock:
+            current = self._segment_id
+            watermark, counts = self._read_snapshot()
+            folded = [i for i in self._segment_ids() if watermark <= i < current]
+            if not folded:
+                return 0
+            for segment_id in folded:
+                with open(self._segment_path(segment_id), "rb") as f:
+                    _ = replay_records(f.read(), counts)
+            self._write_snapshot(current, counts)
+            for segment_id in folded:
+                os.remove(self._segment_path(segment_id))
+            fsync_directory(self.directory)
+            return len(folded)
+
+    def _append(self, deltas: Iterable[Tuple[bytes, int]]) -> int:
+        """Apply deltas in memory, and buffer their records; call with the lock held.
+
+        Returns:
+            The number of records appended so far, to wait for with ``_wait_synced``.
+
+        """
+        if self._closed:
+            raise ValueError("Visit log is closed")
+        if self._error is not None:
+            raise self._error
+        timestamp = time.time_ns() // 1000
+        for key, delta in deltas:
+            count = self._counts.get(key, 0) + delta
+            if count:
+                self._counts[key] = count
+            else:
+                _ = self._counts.pop(key, None)
+            self._buffer += pack_record(key, delta, timestamp)
+            self._appended += 1
+        return self._appended
+
+    def _wait_synced(self, appended: int) -> None:
+        """Wait until the first ``appended`` records are synced, leading a group
+        commit if no other writer is; call with the lock held.
+
+        Raises:
+            OSError: If writing, or syncing, the log failed.
+
+        """
+        while self._synced < appended:
+            if self._error is not None:
+                raise self._error
+            if self._committing:
+                _ = self._committed.wait()
+                continue
+            self._committing = True
+            try:
+                self._commit()
+            finally:
+                self._committing = False
+                self._committed.notify_all()
+
+    def _commit(self) -> None:
+        """Write, and sync, all buffered records as one group; call with the lock
+        held, and ``_committing`` set, so only one thread touches the segment."""
+        self._lock.release()
+        try:
+            if self.commit_delay > 0:
+                time.sleep(self.commit_delay)
+            with self._lock:
+                data, self._buffer = self._buffer, bytearray()
+                appended = self._appended
+            _ = self._file.write(data)
+            self._file.flush()
+            fsync(self._file.fileno())
+            if self._file.tell() >= self.segment_bytes:
+                self._file.close()
+                self._file = self._open_segment(self._segment_id + 1)
+                self._segment_id += 1
+                self._compact_requested.set()
+        except OSError as e:
+            # The segment may now hold a partial write, so refuse any more writes;
+            # reopening the log truncates it
+            self._error = e
+            raise
+        finally:
+            self._lock.acquire()
+        self._synced = appended
+
+    def add(self, key: str, delta: int) -> int:
+        """Add a delta to the count for a key, returning once it is durable.
+
+        Args:
+            key (str): A page hash key of 64 hexadecimal characters.
+            delta (int): An integer to add to the current count; can be negative.
+
+        Returns:
+            The updated integer count.
+
+        """
+        encoded = encode_key(key)
+        with self._lock:
+            appended = self._append([(encoded, delta)])
+            count = self._counts.get(encoded, 0)
+            self._wait_synced(appended)
+        return count
+
+    def set_many(self, counts: Mapping[str, int]) -> None:
+        """Set the counts for a batch of keys, returning once they are durable.
+
+        Args:
+            counts (Mapping[str, int]): A mapping of page hash keys to counts.
+
+        """
+        encoded = {encode_key(k): v for k, v in counts.items()}
+        with self._lock:
+            deltas = [(k, v - self._counts.get(k, 0)) for k, v in encoded.items()]
+            self._wait_synced(self._append((k, d) for k, d in deltas if d))
+
+    def get(self, key: str) -> int:
+        """Get the count for a key.
+
+        Args:
+            key (str): A page hash key of 64 hexadecimal characters.
+
+        Returns:
+            The integer count; zero if the key has never been hit.
+
+        """
+        encoded = encode_key(key)
+        with self._lock:
+            return self._counts.get(encoded, 0)
+
+    def items(self) -> Iterator[Tuple[str, int]]:
+        """Iterate over a snapshot of all key-count pairs, in key order.
+
+        Keys are sorted, as the order of ``_counts`` changes once segments are
+        compacted, and migrations resume from a position in this iteration.
+
+        Returns:
+            An iterator of key-count tuples.
+
+        """
+        with self._lock:
+            snapshot = sorted(self._counts.items())
+        return ((k.hex(), v) for k, v in snapshot)
+
+    def close(self) -> None:
+        """Sync any buffered records, stop compacting, and release the directory."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            with self._lock:
+                self._wait_synced(self._appended)
+        finally:
+            # Stop any further commits, so the segment can be closed
+            with self._lock:
+                while self._committing:
+                    _ = self._committed.wait()
+                self._committing = True
+            self._compact_requested.set()
+            self._compactor.join()
+            self._file.close()
+            self._lock_file.close()